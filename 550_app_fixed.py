@@ -2,84 +2,136 @@
 # ------------------------------------------------------
 
 from __future__ import annotations
-import io, json, zipfile, os, socket, webbrowser, time
+import os, socket, webbrowser, time
 import threading
+import queue
+import select
 from datetime import datetime, timezone
 from typing import Any, Dict
-import requests, pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+import numpy as np
+try:
+    from numba import njit  # optional; speeds up the spectrum axis kernel
+except ImportError:
+    njit = None
+try:
+    import orjson  # optional; faster parsing of large spectra payloads
+except ImportError:
+    orjson = None
 import sys
 _ps_path = os.path.join(os.getcwd(), "particle-scanner")
 if _ps_path not in sys.path:
     sys.path.append(_ps_path)
-from sashimi.stage import Stage
 import serial, serial.tools.list_ports
-import plotly.graph_objs as go
 import dash
-from dash import Dash, dcc, html, Input, Output, State, no_update
+from dash import Dash, dcc, html, Input, Output, State, ctx
+from dash.exceptions import PreventUpdate
 
 APP_TITLE = "SciAps X-550 Basic"
 DEFAULT_PORT_START = 8070
 
+# One pooled session so repeated calls to the same host reuse the TCP connection
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
 # ---------------------- Helpers ----------------------
 
 def ts_utc():
     return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
 def find_open_port(start_port=DEFAULT_PORT_START):
-    port = start_port
-    while True:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(0.2)
-                in_use = (s.connect_ex(("127.0.0.1", port)) == 0)
-            if not in_use:
+    # A bind fails immediately with EADDRINUSE, no connect timeout per busy port.
+    # SO_REUSEADDR only off Windows: there it would let us bind over a live listener.
+    for port in range(start_port, start_port + 100):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            if os.name != "nt":
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                s.bind(("127.0.0.1", port))
                 return port
-            port += 1
-        except OSError:
-            return port
+            except OSError:
+                continue
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _json_of(r):
+    return orjson.loads(r.content) if orjson is not None else r.json()
+
+def _json_body(data: Dict[str, Any] | None):
+    # kwargs for a JSON request body, encoded with orjson when available
+    if orjson is None:
+        return {"json": data or {}}
+    return {"data": orjson.dumps(data or {}), "headers": {"Content-Type": "application/json"}}
 
 def api_get(url, **kw):
-    r = requests.get(url, timeout=30, **kw)
+    r = _SESSION.get(url, timeout=30, **kw)
     r.raise_for_status()
-    return r.json() if r.headers.get("Content-Type", "").startswith("application/json") else r.content
+    return _json_of(r) if r.headers.get("Content-Type", "").startswith("application/json") else r.content
 
 def api_post(url, data: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None, **kw):
-    r = requests.post(url, params=params or {}, json=data or {}, timeout=kw.get("timeout", 600))
+    r = _SESSION.post(url, params=params or {}, timeout=kw.get("timeout", 600), **_json_body(data))
     r.raise_for_status()
-    return r.json()
+    return _json_of(r)
 
 def api_put(url, data: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None, **kw):
-    r = requests.put(url, params=params or {}, json=data or {}, timeout=kw.get("timeout", 60))
+    r = _SESSION.put(url, params=params or {}, timeout=kw.get("timeout", 60), **_json_body(data))
     r.raise_for_status()
-    return r.json() if r.headers.get("Content-Type", "").startswith("application/json") else r.text
+    return _json_of(r) if r.headers.get("Content-Type", "").startswith("application/json") else r.text
+
+_PERIODIC_SYMBOLS = (None, 'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P','S','Cl','Ar',
+                     'K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr',
+                     'Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh','Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe',
+                     'Cs','Ba','La','Ce','Pr','Nd','Pm','Sm','Eu','Gd','Tb','Dy','Ho','Er','Tm','Yb','Lu',
+                     'Hf','Ta','W','Re','Os','Ir','Pt','Au','Hg','Tl','Pb','Bi','Po','At','Rn',
+                     'Fr','Ra','Ac','Th','Pa','U','Np','Pu','Am','Cm','Bk','Cf','Es','Fm','Md','No','Lr',
+                     'Rf','Db','Sg','Bh','Hs','Mt','Ds','Rg','Cn','Nh','Fl','Mc','Lv','Ts','Og')
 
 def normalize_chemistry(result_json: Dict[str, Any]):
-    rows = []
+    # Columnar output: one list per column, turned into a DataFrame once at the end
+    import pandas as pd
+    analytes, values = [], []
     td = result_json.get("testData")
     if isinstance(td, dict) and isinstance(td.get("chemistry"), list):
-        symbols = [None, 'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P','S','Cl','Ar',
-                   'K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr',
-                   'Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh','Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe']
+        add_analyte, add_value = analytes.append, values.append
+        sym = _PERIODIC_SYMBOLS
+        n = len(sym)
         for it in td["chemistry"]:
             z = it.get("atomicNumber")
-            elem = symbols[z] if isinstance(z, int) and 0 < z < len(symbols) else f"Z{z}"
+            elem = sym[z] if type(z) is int and 0 < z < n else f"Z{z}"
             val = it.get("percent")
             if elem and val is not None:
-                rows.append({"analyte": elem, "value": val, "units": "wt%"})
-        return rows
+                add_analyte(elem)
+                add_value(val)
+        return pd.DataFrame({"analyte": analytes, "value": np.asarray(values, dtype=np.float64), "units": "wt%"})
     chem = result_json.get("chemistry") or result_json.get("composition")
     if isinstance(chem, dict):
-        for k, v in chem.items():
-            rows.append({"analyte": k, "value": v})
+        analytes.extend(chem.keys())
+        values.extend(chem.values())
     elif isinstance(chem, list):
         for it in chem:
-            name = it.get("name") or it.get("analyte")
-            val = it.get("value")
-            rows.append({"analyte": name, "value": val})
-    return rows
+            analytes.append(it.get("name") or it.get("analyte"))
+            values.append(it.get("value"))
+    return pd.DataFrame({"analyte": analytes, "value": values})
+
+def _energy_axis(n, e0, slope):
+    out = np.empty(n, dtype=np.float64)
+    for j in range(n):
+        out[j] = e0 + slope * j
+    return out
+
+if njit is not None:
+    # cache=True keeps the compiled kernel on disk so restarts skip the JIT
+    _energy_axis = njit(cache=True)(_energy_axis)
+else:
+    def _energy_axis(n, e0, slope):
+        return e0 + slope * np.arange(n, dtype=np.float64)
 
 def normalize_spectra(result_json: Dict[str, Any]):
-    spectra = []
+    # Long format (shot, x, y): all shots share three contiguous float64/str columns
+    import pandas as pd
+    names, xs, ys = [], [], []
     specs = result_json.get("spectra")
     if isinstance(specs, list):
         for i, sp in enumerate(specs, start=1):
@@ -88,13 +140,25 @@ def normalize_spectra(result_json: Dict[str, Any]):
                 continue
             e0 = sp.get("energyOffset", 0.0)
             slope = sp.get("energySlope", 1.0)
-            x = [e0 + slope * j for j in range(len(y))]
-            name = sp.get("beamName") or f"beam_{i}"
-            spectra.append({"shot": name, "x": x, "y": y})
-    return spectra
+            y = np.asarray(y, dtype=np.float64)
+            names.append(sp.get("beamName") or f"beam_{i}")
+            xs.append(_energy_axis(y.size, float(e0), float(slope)))
+            ys.append(y)
+    if not ys:
+        return pd.DataFrame({"shot": [], "x": np.empty(0), "y": np.empty(0)})
+    return pd.DataFrame({
+        "shot": np.repeat(names, [y.size for y in ys]),
+        "x": np.concatenate(xs),
+        "y": np.concatenate(ys),
+    })
 
 # ---------------------- App ----------------------
 
+if orjson is not None:
+    # Dash encodes callback responses through plotly's JSON layer; orjson handles ndarrays natively
+    import plotly.io as pio
+    pio.json.config.default_engine = "orjson"
+
 app = Dash(__name__)
 app.title = APP_TITLE
 
@@ -102,10 +166,8 @@ app.layout = html.Div([
     html.H2(APP_TITLE),
     # Needed by callbacks
     dcc.Store(id="store-stage-ready"),
-    dcc.Interval(id="stage-poll", interval=1000, n_intervals=0),
-    # Keyboard support state
+    # Keyboard support state; key-poll is also the 1 Hz status clock (every 5th tick)
     dcc.Store(id="store-key"),
-    dcc.Store(id="store-key-ts"),
     dcc.Interval(id="key-poll", interval=200, n_intervals=0),
     html.Div([
         html.Label("Connection"),
@@ -144,6 +206,13 @@ app.layout = html.Div([
 
 # ---------------------- Stage Controls ----------------------
 
+# Pre-encoded fixed commands; the heartbeat sends M105 every second
+_CMD_M105 = b"M105\r\n"
+_CMD_M115 = b"M115\r\n"
+_CMD_G28 = b"G28\r\n"
+_CMD_G29 = b"G29\r\n"
+_CANNED = {"M105": _CMD_M105, "M115": _CMD_M115, "G28": _CMD_G28, "G29": _CMD_G29}
+
 class SerialStage:
     def __init__(self, com_port: str, baud: int = 115200):
         self.ser = serial.Serial(
@@ -153,8 +222,11 @@ class SerialStage:
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
             timeout=1,
-            write_timeout=1,
+            write_timeout=0,  # non-blocking: a stalled bus must not hold up a callback
         )
+        self._lock = threading.Lock()
+        self._tx = bytearray()  # bytes the port would not take yet
+        self._tx_pending = threading.Event()  # set while _tx holds a tail for the flusher
         try:
             self.ser.dtr = False
             self.ser.rts = False
@@ -168,98 +240,211 @@ class SerialStage:
             self.ser.reset_output_buffer()
         except Exception:
             pass
-        self._send("M115")
-            Output("stage-action-status", "children"),
-            Output("store-key-ts", "data"),
-            Input("store-key", "data"),
-            Input("btn-stage-home", "n_clicks"),
-            Input("btn-stage-level", "n_clicks"),
-            Input("btn-left", "n_clicks"),
-            Input("btn-right", "n_clicks"),
-            Input("btn-up", "n_clicks"),
-            Input("btn-down", "n_clicks"),
-            Input("btn-z-up", "n_clicks"),
-            Input("btn-z-down", "n_clicks"),
-            State("store-key-ts", "data"),
-            State("jog-um", "value"),
-        )
-        def stage_actions(key_data, n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown, last_ts, jog_um):
+        # Firmware replies are drained here so _send never waits on readline();
+        # the heartbeat only needs to know when the last one arrived
+        self.last_rx = time.monotonic()
+        threading.Thread(target=self._reader, daemon=True).start()
+        threading.Thread(target=self._flusher, daemon=True).start()
+        self._send(_CMD_M115)
+        self.x = 0
+        self.y = 0
+        self.z = 0
+
+    def _reader(self):
+        pending = b""
+        while self.ser.is_open:
+            try:
+                pending += self.ser.read(self.ser.in_waiting or 1)
+            except Exception:
+                break
+            *lines, pending = pending.split(b"\n")
+            if any(line.strip() for line in lines):
+                self.last_rx = time.monotonic()
+
+    def _send(self, cmd: str | bytes):
+        if isinstance(cmd, bytes):
+            data = cmd
+        else:
+            data = _CANNED.get(cmd) or (cmd.strip() + "\r\n").encode("ascii")
+        # Shared with the heartbeat thread so a jog and an M105 never interleave on the wire
+        with self._lock:
+            self._tx += data
+            self._drain_tx()
+            if self._tx:
+                self._tx_pending.set()
+
+    def _flusher(self):
+        # Writes out whatever _send left in self._tx, so the tail of the last command
+        # does not sit there until another command comes along
+        while self.ser.is_open:
+            if not self._tx_pending.wait(timeout=1.0):
+                continue
+            with self._lock:
+                self._drain_tx()
+                if not self._tx:
+                    self._tx_pending.clear()
+                    continue
+            time.sleep(0.01)  # port still full; let it drain before trying again
+
+    def _drain_tx(self):
+        # Caller holds self._lock. Whatever the port refuses stays queued in
+        # self._tx; the flusher thread retries it.
+        try:
+            fd = self.ser.fileno()
+        except Exception:
+            fd = None  # Windows ports have no selectable fd
+        if fd is not None:
+            _, writable, _ = select.select([], [fd], [], 0.05)
+            if not writable:
+                return
+        try:
+            n = self.ser.write(bytes(self._tx))
+        except serial.SerialTimeoutException:
+            return
+        del self._tx[:n or 0]
 
     def move_home(self, home_position=(0,0,0)):
-                return "Stage not connected.", last_ts
+        self._send(_CMD_G28)
         self.goto(home_position)
-            if not ctx.triggered:
-                return no_update, last_ts
-            which = ctx.triggered[0]['prop_id'].split('.')[0]
+
+    def auto_level(self):
+        self._send(_CMD_G29)
 
     def move_x(self, distance_um: int):
         self.goto_x(self.x + distance_um)
 
+    def move_y(self, distance_um: int):
+        self.goto_y(self.y + distance_um)
+
+    def move_z(self, distance_um: int):
+        self.goto_z(self.z + distance_um)
+
+    def goto_x(self, position_um: int):
+        self.x = max(0, position_um)
+        self._send(b"G0 X %.3f F3000\r\n" % (self.x / 1000))
+
+    def goto_y(self, position_um: int):
+        self.y = max(0, position_um)
+        self._send(b"G0 Y %.3f F3000\r\n" % (self.y / 1000))
+
+    def goto_z(self, position_um: int):
+        self.z = max(0, position_um)
+        self._send(b"G0 Z %.3f F300\r\n" % (self.z / 1000))
+
+    def goto(self, pos):
+        self.goto_x(pos[0]); self.goto_y(pos[1]); self.goto_z(pos[2])
+
+    def move_rel(self, dx_um: int = 0, dy_um: int = 0, dz_um: int = 0):
+        # One G0 for a combined jog instead of a line per axis
+        parts = [b"G0"]
+        if dx_um:
+            self.x = max(0, self.x + dx_um)
+            parts.append(b"X %.3f" % (self.x / 1000))
+        if dy_um:
+            self.y = max(0, self.y + dy_um)
+            parts.append(b"Y %.3f" % (self.y / 1000))
+        if dz_um:
+            self.z = max(0, self.z + dz_um)
+            parts.append(b"Z %.3f" % (self.z / 1000))
+        if len(parts) == 1:
+            return
+        parts.append(b"F300\r\n" if dz_um else b"F3000\r\n")
+        self._send(b" ".join(parts))
+
+_stage_instance: object | None = None
+
+# comports() is a WMI/udev scan; the dropdown polls every second, so reuse it for a while
+_COM_CACHE = [0.0, []]
+
+def _cached_comports(ttl: float = 10.0):
+    now = time.monotonic()
+    if now - _COM_CACHE[0] > ttl:
+        _COM_CACHE[:] = [now, list(serial.tools.list_ports.comports())]
+    return _COM_CACHE[1]
+
+# ---------------------- Heartbeat ----------------------
+
+# Written by the heartbeat thread, read by stage_connection_indicator
+_hb_state = {"ok": False, "msg": "Heartbeat: Not connected"}
+_hb_thread: threading.Thread | None = None
+
+def _hb_loop(interval: float = 1.0):
+    while True:
+        time.sleep(interval)
+        stage = _stage_instance
+        if stage is None:
+            _hb_state.update(ok=False, msg="Heartbeat: Not connected")
+        elif isinstance(stage, SerialStage):
             try:
-                # Keyboard path
-                if which == "store-key":
-                    if not key_data:
-                        return no_update, last_ts
-                    ts = key_data.get("ts")
-                    if last_ts == ts:
-                        return no_update, last_ts
-                    key = key_data.get("key")
-                    shift = bool(key_data.get("shift"))
-                    if shift and key == "ArrowUp":
-                        _stage_instance.move_z(step)
-                        return f"Moved Z by +{step} µm.", ts
-                    if shift and key == "ArrowDown":
-                        _stage_instance.move_z(-step)
-                        return f"Moved Z by -{step} µm.", ts
-                    if key == "ArrowLeft":
-                        _stage_instance.move_x(-step)
-                        return f"Moved X by -{step} µm.", ts
-                    if key == "ArrowRight":
-                        _stage_instance.move_x(step)
-                        return f"Moved X by +{step} µm.", ts
-                    if key == "ArrowUp":
-                        _stage_instance.move_y(step)
-                        return f"Moved Y by +{step} µm.", ts
-                    if key == "ArrowDown":
-                        _stage_instance.move_y(-step)
-                        return f"Moved Y by -{step} µm.", ts
-                    return no_update, last_ts
-
-                # Buttons path
-                if which == "btn-stage-home":
-                    _stage_instance.move_home((0, 0, 0))
-                    return "Homing sent (G28).", last_ts
-                if which == "btn-stage-level":
-                    _stage_instance.auto_level()
-                    return "Auto level sent (G29).", last_ts
-                if which == "btn-left":
-                    _stage_instance.move_x(-step)
-                    return f"Moved X by -{step} µm.", last_ts
-                if which == "btn-right":
-                    _stage_instance.move_x(step)
-                    return f"Moved X by +{step} µm.", last_ts
-                if which == "btn-up":
-                    _stage_instance.move_y(step)
-                    return f"Moved Y by +{step} µm.", last_ts
-                if which == "btn-down":
-                    _stage_instance.move_y(-step)
-                    return f"Moved Y by -{step} µm.", last_ts
-                if which == "btn-z-down":
-                    _stage_instance.move_z(-step)
-                    return f"Moved Z by -{step} µm.", last_ts
-                if which == "btn-z-up":
-                    _stage_instance.move_z(step)
-                    return f"Moved Z by +{step} µm.", last_ts
-                return no_update, last_ts
+                stage._send(_CMD_M105)  # temperature query, safe
             except Exception as e:
-                return f"Stage action failed: {e}", last_ts
+                _hb_state.update(ok=False, msg=f"Heartbeat: USB write failed: {e}")
+                continue
+            # OK only if the firmware has answered one of the last few M105s
+            age = time.monotonic() - stage.last_rx
+            if age < 3 * interval:
+                _hb_state.update(ok=True, msg="Heartbeat: USB OK")
+            else:
+                _hb_state.update(ok=False, msg=f"Heartbeat: no reply for {age:.0f}s")
+        else:
+            _hb_state.update(ok=True, msg="Heartbeat: HTTP OK")
 
-        # Poll the window event into a store (clientside, in-browser)
-        app.clientside_callback(
-            "function(n){ const ev = window.dashKeyEvent; return ev || null; }",
-            Output("store-key", "data"),
-            Input("key-poll", "n_intervals")
-        )
+def _start_heartbeat():
+    global _hb_thread
+    if _hb_thread is None or not _hb_thread.is_alive():
+        _hb_thread = threading.Thread(target=_hb_loop, daemon=True)
+        _hb_thread.start()
+
+# ---------------------- Jog queue ----------------------
+
+# Callbacks enqueue (dx, dy, dz) in µm; the worker sums a 20 ms burst into one move
+_jog_q: queue.Queue = queue.Queue()
+_jog_thread: threading.Thread | None = None
+
+def _apply_jog(stage, dx, dy, dz):
+    if isinstance(stage, SerialStage):
+        stage.move_rel(dx, dy, dz)
+        return
+    if dx:
+        stage.move_x(dx)
+    if dy:
+        stage.move_y(dy)
+    if dz:
+        stage.move_z(dz)
+
+def _jog_worker(window: float = 0.02):
+    while True:
+        items = [_jog_q.get()]
+        time.sleep(window)
+        while True:
+            try:
+                items.append(_jog_q.get_nowait())
+            except queue.Empty:
+                break
+        dx = sum(i[0] for i in items)
+        dy = sum(i[1] for i in items)
+        dz = sum(i[2] for i in items)
+        stage = _stage_instance
+        if stage is None or not (dx or dy or dz):
+            continue
+        try:
+            _apply_jog(stage, dx, dy, dz)
+        except Exception as e:
+            print(f"[jog] move failed: {e}")
+
+def _start_jog_worker():
+    global _jog_thread
+    if _jog_thread is None or not _jog_thread.is_alive():
+        _jog_thread = threading.Thread(target=_jog_worker, daemon=True)
+        _jog_thread.start()
+
+# ---------------------- Callbacks ----------------------
+
+@app.callback(
+    Output("stage-connect-status", "children"),
+    Output("store-stage-ready", "data"),
+    Input("btn-stage-connect", "n_clicks"),
+    State("stage-conn-type", "value"),
     State("printer-host", "value"),
     State("printer-port", "value"),
     State("printer-com", "value"),
@@ -274,13 +459,15 @@ def stage_connect(_n, conn_type, host, port, com, baud):
             return "Click to connect…", dash.no_update
         if conn_type == "usb":
             if not com:
-                ports = [p.device for p in serial.tools.list_ports.comports()]
+                ports = [p.device for p in _cached_comports()]
                 fallback = "COM4" if (not ports or "COM4" in ports) else (ports[0] if ports else None)
                 if fallback is None:
                     return "Select COM port from dropdown. (no ports detected)", None
                 com = fallback
             b = int(baud) if baud else 115200
             _stage_instance = SerialStage(com_port=com, baud=b)
+            _start_heartbeat()
+            _start_jog_worker()
             return f"Stage connected via USB on {com} @ {b} baud.", {"ok": True, "type": "usb", "com": com, "baud": b}
         elif conn_type == "http":
             if not host or not port:
@@ -289,9 +476,13 @@ def stage_connect(_n, conn_type, host, port, com, baud):
             if not h.startswith("http://") and not h.startswith("https://"):
                 h = "http://" + h
             url = f"{h}:{int(port)}/printer/info"
-            r = requests.get(url, timeout=10)
+            r = _SESSION.get(url, timeout=10)
             r.raise_for_status()
+            # Only the Moonraker path needs sashimi; keep it off the startup import path
+            from sashimi.stage import Stage
             _stage_instance = Stage(controller=None, printer_ip=h, port=int(port))
+            _start_heartbeat()
+            _start_jog_worker()
             return "Stage connected.", {"ok": True, "type": "http", "host": h, "port": int(port)}
         else:
             return "Select connection type.", None
@@ -299,7 +490,7 @@ def stage_connect(_n, conn_type, host, port, com, baud):
         _stage_instance = None
         msg = str(e)
         if conn_type == "usb":
-            ports = [p.device for p in serial.tools.list_ports.comports()]
+            ports = [p.device for p in _cached_comports()]
             if ports:
                 msg += f" | Detected ports: {', '.join(ports)}"
             else:
@@ -308,36 +499,66 @@ def stage_connect(_n, conn_type, host, port, com, baud):
 
 @app.callback(
     Output("stage-conn-heartbeat", "children"),
-    Input("stage-poll", "n_intervals"),
+    Input("key-poll", "n_intervals"),
 )
-def stage_connection_indicator(_n):
-    try:
-        ok = _stage_instance is not None
-        if ok:
-            if isinstance(_stage_instance, SerialStage):
-                try:
-                    _stage_instance._send("M105")
-                    return "Heartbeat: USB OK"
-                except Exception as e:
-                    return f"Heartbeat: USB write failed: {e}"
-            return "Heartbeat: HTTP OK"
+def stage_connection_indicator(n):
+    if (n or 0) % 5:
+        raise PreventUpdate
+    # Serial I/O happens on the heartbeat thread; just report its last result
+    if _stage_instance is None:
         return "Heartbeat: Not connected"
-    except Exception as e:
-        return f"Heartbeat error: {e}"
+    return _hb_state["msg"]
 
 @app.callback(
     Output("printer-com", "options"),
     Output("printer-com", "value"),
-    Input("stage-poll", "n_intervals"),
+    Input("key-poll", "n_intervals"),
 )
-def populate_com_dropdown(_n):
-    ports = list(serial.tools.list_ports.comports())
+def populate_com_dropdown(n):
+    if (n or 0) % 5:
+        raise PreventUpdate
+    ports = _cached_comports()
     options = [{"label": f"{p.device} — {p.description}", "value": p.device} for p in ports]
     value = options[0]["value"] if options else None
     return options, value
 
+# Key polling: arrow presses are summed in the browser and handed over once per tick
+app.clientside_callback(
+    """
+    function(n){
+        if (!window._jogListener) {
+            window._jogAccum = {dx: 0, dy: 0, dz: 0};
+            window._jogListener = function(e){
+                const tag = (e.target && e.target.tagName) || "";
+                if (tag === "INPUT" || tag === "TEXTAREA" || tag === "SELECT") { return; }
+                const acc = window._jogAccum;
+                if (e.key === "ArrowLeft") { acc.dx -= 1; }
+                else if (e.key === "ArrowRight") { acc.dx += 1; }
+                else if (e.key === "ArrowUp") { if (e.shiftKey) { acc.dz += 1; } else { acc.dy += 1; } }
+                else if (e.key === "ArrowDown") { if (e.shiftKey) { acc.dz -= 1; } else { acc.dy -= 1; } }
+                else { return; }
+                e.preventDefault();
+            };
+            document.addEventListener("keydown", window._jogListener);
+        }
+        const acc = window._jogAccum;
+        if (!acc.dx && !acc.dy && !acc.dz) { return window.dash_clientside.no_update; }
+        const ev = {dx: acc.dx, dy: acc.dy, dz: acc.dz, ts: Date.now()};
+        acc.dx = 0; acc.dy = 0; acc.dz = 0;
+        return ev;
+    }
+    """,
+    Output("store-key", "data"),
+    Input("key-poll", "n_intervals")
+)
+
+def _fmt_jog(dx, dy, dz):
+    parts = [f"{axis} by {d:+d}" for axis, d in (("X", dx), ("Y", dy), ("Z", dz)) if d]
+    return "Moved " + ", ".join(parts) + " µm."
+
 @app.callback(
     Output("stage-action-status", "children"),
+    Input("store-key", "data"),
     Input("btn-stage-home", "n_clicks"),
     Input("btn-stage-level", "n_clicks"),
     Input("btn-left", "n_clicks"),
@@ -348,19 +569,27 @@ def populate_com_dropdown(_n):
     Input("btn-z-down", "n_clicks"),
     State("jog-um", "value"),
 )
-def stage_actions(n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown, jog_um):
+def stage_actions(key_data, n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown, jog_um):
     global _stage_instance
+    which = ctx.triggered_id
+    # Idle ticks: bail out before any work so Dash sends no response body
+    if which is None or (which == "store-key" and not key_data):
+        raise PreventUpdate
     if not _stage_instance:
         return "Stage not connected."
-    ctx = dash.callback_context
-    if not ctx.triggered:
-        return no_update
-    which = ctx.triggered[0]['prop_id'].split('.')[0]
     try:
         step = int(jog_um) if jog_um is not None else 1000
     except Exception:
         step = 1000
     try:
+        if which == "store-key":
+            dx = int(key_data.get("dx") or 0) * step
+            dy = int(key_data.get("dy") or 0) * step
+            dz = int(key_data.get("dz") or 0) * step
+            if not (dx or dy or dz):
+                raise PreventUpdate
+            _jog_q.put((dx, dy, dz))
+            return _fmt_jog(dx, dy, dz)
         if which == "btn-stage-home":
             _stage_instance.move_home((0, 0, 0))
             return "Homing sent (G28)."
@@ -368,43 +597,52 @@ def stage_actions(n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown, jog_
             _stage_instance.auto_level()
             return "Auto level sent (G29)."
         if which == "btn-left":
-            _stage_instance.move_x(-step)
+            _jog_q.put((-step, 0, 0))
             return f"Moved X by -{step} µm."
         if which == "btn-right":
-            _stage_instance.move_x(step)
+            _jog_q.put((step, 0, 0))
             return f"Moved X by +{step} µm."
         if which == "btn-up":
-            _stage_instance.move_y(step)
+            _jog_q.put((0, step, 0))
             return f"Moved Y by +{step} µm."
         if which == "btn-down":
-            _stage_instance.move_y(-step)
+            _jog_q.put((0, -step, 0))
             return f"Moved Y by -{step} µm."
         if which == "btn-z-down":
-            _stage_instance.move_z(-step)
+            _jog_q.put((0, 0, -step))
             return f"Moved Z by -{step} µm."
         if which == "btn-z-up":
-            _stage_instance.move_z(step)
+            _jog_q.put((0, 0, step))
             return f"Moved Z by +{step} µm."
-        return no_update
+        raise PreventUpdate
+    except PreventUpdate:
+        raise
     except Exception as e:
         return f"Stage action failed: {e}"
 
 if __name__ == '__main__':
-    def _open_browser_when_ready(url: str, timeout: float = 20.0):
+    def _open_browser_when_ready(url: str, port: int, timeout: float = 20.0):
+        # The server is ready once it accepts TCP; no need for a full HTTP round-trip
         start = time.time()
         while time.time() - start < timeout:
             try:
-                r = requests.get(url, timeout=0.5)
-                if r.status_code in (200, 302, 404):
-                    webbrowser.open(url)
-                    return
-            except Exception:
-                time.sleep(0.3)
+                socket.create_connection(("127.0.0.1", port), timeout=0.05).close()
+                webbrowser.open(url)
+                return
+            except OSError:
+                time.sleep(0.05)
         # fallback: open anyway
         webbrowser.open(url)
 
     port = find_open_port()
     url = f"http://127.0.0.1:{port}"
     print(f"Starting server on {url}")
-    threading.Thread(target=_open_browser_when_ready, args=(url,), daemon=True).start()
-    app.run(debug=False, port=port, host="127.0.0.1", use_reloader=False)
+    threading.Thread(target=_open_browser_when_ready, args=(url, port), daemon=True).start()
+    try:
+        from waitress import serve  # optional production WSGI server
+    except ImportError:
+        serve = None
+    if serve is not None:
+        serve(app.server, host="127.0.0.1", port=port, threads=8)
+    else:
+        app.run(debug=False, port=port, host="127.0.0.1", use_reloader=False, threaded=True)
@@ -4,14 +4,25 @@
 from __future__ import annotations
 import io, json, zipfile, os, socket, webbrowser, time
 import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from typing import Any, Dict
 from datetime import datetime, timezone
+from functools import lru_cache
 
 import sys
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import serial
 import serial.tools.list_ports
+import serial.threaded
+try:
+    import serial_asyncio  # optional; pyserial-asyncio(-fast) for non-blocking USB I/O
+except ImportError:
+    serial_asyncio = None
 import dash
 import plotly.graph_objs as go
 from dash import Dash, dcc, html, Input, Output, State, no_update
@@ -28,23 +39,28 @@ except Exception:
 APP_TITLE = "SciAps X-550 Basic"
 DEFAULT_PORT_START = 8070
 
+# Moonraker probe: pooled connection, one quick retry on gateway errors
+_HTTP = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=2, pool_maxsize=2,
+                            max_retries=Retry(total=1, backoff_factor=0.2, status_forcelist=(502, 503, 504)))
+_HTTP.mount("http://", _http_adapter)
+_HTTP.mount("https://", _http_adapter)
+
 # ---------------------- Helpers ----------------------
 
 def ts_utc():
     return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
 def find_open_port(start_port: int = DEFAULT_PORT_START) -> int:
-    port = start_port
-    while True:
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(0.2)
-                in_use = (s.connect_ex(("127.0.0.1", port)) == 0)
-            if not in_use:
-                return port
-            port += 1
-        except OSError:
-            return port
+    # A bind test answers immediately; if start_port is taken let the OS pick one
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", start_port or 0))
+            return s.getsockname()[1]
+    except OSError:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
 
 # ---------------------- App ----------------------
 
@@ -63,7 +79,8 @@ app.layout = html.Div([
 
     # Timers
     dcc.Interval(id="stage-poll", interval=1500, n_intervals=0, disabled=True),
-    dcc.Interval(id="key-poll", interval=200, n_intervals=0),
+    dcc.Interval(id="key-init", interval=100, max_intervals=1),
+    dcc.Interval(id="com-poll", interval=5000, n_intervals=0),
 
     # Connection row
     html.Div([
@@ -103,6 +120,7 @@ app.layout = html.Div([
         html.Button("Default Location of Top Left Cup 1", id="btn-default-cup-1"),
         html.Button("Default Location of Top Left Cup 2", id="btn-default-cup-2"),
         html.Button("Start Sequence", id="btn-start-sequence"),
+        html.Span(id="seq-status", style={"fontStyle": "italic", "color": "#555"}),
     ], style={"display": "flex", "gap": "8px", "alignItems": "center", "flexWrap": "wrap", "marginTop": "6px"}),
 
     # Movement controls
@@ -126,7 +144,53 @@ app.layout = html.Div([
 
 # ---------------------- Serial Stage ----------------------
 
+@lru_cache(maxsize=4096)
+def _um_to_mm_bytes(um: int) -> bytes:
+    return b"%.3f" % (um / 1000)
+
+GCODE_WINDOW = 4  # Marlin BUFSIZE: commands it will queue before it stops reading
+
+class MarlinProto(serial.threaded.LineReader):
+    """Resolves one pending Future per ok/error line; other firmware chatter is ignored."""
+
+    TERMINATOR = b"\n"
+
+    def __init__(self):
+        super().__init__()
+        self.waiters: deque[Future] = deque()
+        self.send_lock = threading.Lock()
+        self.last_rx = time.monotonic()
+
+    def submit(self, cmd: str) -> Future:
+        return self.submit_bytes(cmd.strip().encode(self.ENCODING) + self.TERMINATOR)
+
+    def submit_bytes(self, data: bytes) -> Future:
+        fut: Future = Future()
+        # Queue order must match wire order, or acks get paired with the wrong command
+        with self.send_lock:
+            self.waiters.append(fut)
+            self.transport.write(data)
+        return fut
+
+    def handle_line(self, line: str):
+        self.last_rx = time.monotonic()
+        line = line.strip()
+        if line.startswith("ok") or line.startswith("error"):
+            if self.waiters:
+                fut = self.waiters.popleft()
+                if not fut.done():
+                    fut.set_result(line)
+
 class SerialStage:
+    # Fixed commands, encoded once
+    _CANNED = {
+        "G28": b"G28\n",
+        "G29": b"G29\n",
+        "M105": b"M105\n",
+        "M115": b"M115\n",
+        "M155 S1": b"M155 S1\n",
+    }
+
     def __init__(self, com_port: str, baud: int = 115200):
         self.ser = serial.Serial(
             com_port,
@@ -137,6 +201,12 @@ class SerialStage:
             timeout=1,
             write_timeout=1,
         )
+        # Driver buffers of ~0.1 s of traffic (baud/10 bytes per second); only win32 supports this
+        if hasattr(self.ser, "set_buffer_size"):
+            try:
+                self.ser.set_buffer_size(rx_size=max(4096, baud // 8), tx_size=4096)
+            except Exception:
+                pass
         try:
             self.ser.dtr = False
             self.ser.rts = False
@@ -150,26 +220,39 @@ class SerialStage:
             self.ser.reset_output_buffer()
         except Exception:
             pass
-        self._send("M115")
+        # All reads happen on this thread; callbacks just write and wait on a Future
+        self._proto = MarlinProto()
+        self._reader = serial.threaded.ReaderThread(self.ser, lambda: self._proto)
+        self._reader.start()
+        self._reader.connect()
+        self._send_bytes(self._CANNED["M115"])
+        self._send_bytes(self._CANNED["M155 S1"])  # 1 Hz temperature autoreport doubles as the liveness signal
         self.x = 0
         self.y = 0
         self.z = 0
 
+    @property
+    def last_rx(self) -> float:
+        return self._proto.last_rx
+
     def _send(self, cmd: str) -> str:
-        data = (cmd.strip() + "\r\n").encode("ascii")
-        self.ser.write(data)
-        self.ser.flush()
+        data = self._CANNED.get(cmd) or cmd.strip().encode("ascii") + b"\n"
+        return self._send_bytes(data)
+
+    def _send_bytes(self, data: bytes) -> str:
+        # data must already be a complete line
+        fut = self._proto.submit_bytes(data)
         try:
-            return self.ser.readline().decode(errors="ignore")
-        except Exception:
+            return fut.result(timeout=1.0)
+        except FutureTimeout:
             return ""
 
     def move_home(self, home_position=(0,0,0)):
-        self._send("G28")
+        self._send_bytes(self._CANNED["G28"])
         self.goto(home_position)
 
     def auto_level(self):
-        self._send("G29")
+        self._send_bytes(self._CANNED["G29"])
 
     def move_x(self, distance_um: int):
         self.goto_x(self.x + distance_um)
@@ -182,20 +265,161 @@ class SerialStage:
 
     def goto_x(self, position_um: int):
         self.x = max(0, position_um)
-        self._send(f"G0 X {self.x/1000:.3f} F3000")
+        self._send_bytes(b"G0 X " + _um_to_mm_bytes(self.x) + b" F3000\n")
 
     def goto_y(self, position_um: int):
         self.y = max(0, position_um)
-        self._send(f"G0 Y {self.y/1000:.3f} F3000")
+        self._send_bytes(b"G0 Y " + _um_to_mm_bytes(self.y) + b" F3000\n")
 
     def goto_z(self, position_um: int):
         self.z = max(0, position_um)
-        self._send(f"G0 Z {self.z/1000:.3f} F300")
+        self._send_bytes(b"G0 Z " + _um_to_mm_bytes(self.z) + b" F300\n")
 
     def goto(self, pos):
         self.goto_x(pos[0]); self.goto_y(pos[1]); self.goto_z(pos[2])
 
-_stage_instance: object | None = None
+    def run_gcode_program(self, lines: list[str], timeout: float = 30.0) -> int:
+        """Stream G-code and let the firmware plan it; returns the number of 'ok' acks seen.
+
+        At most GCODE_WINDOW lines are in flight so Marlin's small RX buffer never overruns.
+        """
+        deadline = serial.Timeout(timeout)
+        in_flight: deque[Future] = deque()
+        acked = 0
+        try:
+            for ln in lines:
+                if not ln.strip():
+                    continue
+                if len(in_flight) >= GCODE_WINDOW:
+                    acked += in_flight.popleft().result(deadline.time_left()).startswith("ok")
+                in_flight.append(self._proto.submit(ln))
+            while in_flight:
+                acked += in_flight.popleft().result(deadline.time_left()).startswith("ok")
+        except FutureTimeout:
+            pass
+        return acked
+
+# ---------------------- Async Serial Stage ----------------------
+
+_aio_loop: asyncio.AbstractEventLoop | None = None
+
+def _get_aio_loop() -> asyncio.AbstractEventLoop:
+    # One event loop for all serial I/O, running on its own daemon thread
+    global _aio_loop
+    if _aio_loop is None:
+        _aio_loop = asyncio.new_event_loop()
+        threading.Thread(target=_aio_loop.run_forever, daemon=True).start()
+    return _aio_loop
+
+class AsyncSerialStage(SerialStage):
+    """SerialStage on pyserial-asyncio: writes never block, replies wait at most 0.5 s."""
+
+    def __init__(self, com_port: str, baud: int = 115200):
+        self._loop = _get_aio_loop()
+        self._reader, self._writer = self._run(
+            serial_asyncio.open_serial_connection(url=com_port, baudrate=baud), timeout=5.0)
+        # Same pairing as MarlinProto: a read task resolves one future per ok/error line
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_rx = time.monotonic()
+        asyncio.run_coroutine_threadsafe(self._read_loop(), self._loop)
+        self._send_bytes(self._CANNED["M115"])
+        self._send_bytes(self._CANNED["M155 S1"])
+        self.x = 0
+        self.y = 0
+        self.z = 0
+
+    @property
+    def last_rx(self) -> float:
+        return self._last_rx
+
+    def _run(self, coro, timeout: float = 1.0):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def _read_loop(self):
+        while True:
+            raw = await self._reader.readline()
+            if not raw:
+                break
+            self._last_rx = time.monotonic()
+            line = raw.decode(errors="ignore").strip()
+            if (line.startswith("ok") or line.startswith("error")) and self._waiters:
+                fut = self._waiters.popleft()
+                if not fut.done():
+                    fut.set_result(line)
+
+    def _submit(self, data: bytes) -> asyncio.Future:
+        # Runs on the loop thread, so queueing and writing cannot interleave with another send
+        fut = self._loop.create_future()
+        self._waiters.append(fut)
+        self._writer.write(data)
+        return fut
+
+    async def _asend(self, data: bytes) -> str:
+        fut = self._submit(data)
+        await self._writer.drain()
+        try:
+            return await asyncio.wait_for(fut, 0.5)
+        except asyncio.TimeoutError:
+            return ""
+
+    def _send_bytes(self, data: bytes) -> str:
+        return self._run(self._asend(data))
+
+    async def _arun_program(self, lines: list[str], timeout: float) -> int:
+        in_flight: deque[asyncio.Future] = deque()
+        acked = 0
+        deadline = self._loop.time() + timeout
+
+        async def _ack():
+            left = max(0.0, deadline - self._loop.time())
+            return (await asyncio.wait_for(in_flight.popleft(), left)).startswith("ok")
+
+        try:
+            for ln in lines:
+                if len(in_flight) >= GCODE_WINDOW:
+                    acked += await _ack()
+                in_flight.append(self._submit(ln.strip().encode("ascii") + b"\n"))
+                await self._writer.drain()
+            while in_flight:
+                acked += await _ack()
+        except asyncio.TimeoutError:
+            pass
+        return acked
+
+    def run_gcode_program(self, lines: list[str], timeout: float = 30.0) -> int:
+        lines = [ln for ln in lines if ln.strip()]
+        return self._run(self._arun_program(lines, timeout), timeout=timeout + 1.0)
+
+# Dash serves callbacks from a thread pool: the connected stage is only touched under this lock
+_stage_lock = threading.RLock()
+
+class StageRegistry:
+    # Its own short lock, never held during serial I/O; reads are a plain attribute load
+    instance: object | None = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        return cls.instance
+
+    @classmethod
+    def set(cls, stage):
+        with cls._lock:
+            cls.instance = stage
+
+# COM port enumeration is slow on Windows (registry walk); re-check at most every few seconds
+_PORTS_TTL = 4.5  # a little under the com-poll period so ticks are never skipped
+_ports_cache: Dict[str, Any] = {"ts": 0.0, "ports": (), "shown": None}
+_ports_lock = threading.Lock()
+
+def _get_ports_cached(ttl: float = 2.0) -> tuple[tuple[str, str], ...]:
+    """(device, description) for each serial port, re-enumerated at most every ttl seconds."""
+    # Locked so concurrent callbacks wait for one enumeration instead of each starting their own
+    with _ports_lock:
+        if time.monotonic() - _ports_cache["ts"] >= ttl:
+            _ports_cache["ports"] = tuple((p.device, p.description) for p in serial.tools.list_ports.comports())
+            _ports_cache["ts"] = time.monotonic()
+        return _ports_cache["ports"]
 
 # ---------------------- Callbacks ----------------------
 
@@ -211,7 +435,6 @@ _stage_instance: object | None = None
     State("printer-baud", "value"),
 )
 def stage_connect(_n, conn_type, host, port, com, baud):
-    global _stage_instance
     try:
         if conn_type is None:
             conn_type = "usb"
@@ -219,12 +442,14 @@ def stage_connect(_n, conn_type, host, port, com, baud):
             return "Click to connect…", dash.no_update, True
         if conn_type == "usb":
             if not com:
-                ports = [p.device for p in serial.tools.list_ports.comports()]
+                ports = [dev for dev, _ in _get_ports_cached()]
                 com = "COM4" if (not ports or "COM4" in ports) else (ports[0] if ports else None)
                 if com is None:
                     return "Select COM port from dropdown. (no ports detected)", None
             b = int(baud) if baud else 115200
-            _stage_instance = SerialStage(com_port=com, baud=b)
+            stage_cls = AsyncSerialStage if serial_asyncio is not None else SerialStage
+            StageRegistry.set(None)
+            StageRegistry.set(stage_cls(com_port=com, baud=b))
             return f"Stage connected via USB on {com} @ {b} baud.", {"ok": True, "type": "usb", "com": com, "baud": b}, False
         elif conn_type == "http":
             if not host or not port or Stage is None:
@@ -233,17 +458,17 @@ def stage_connect(_n, conn_type, host, port, com, baud):
             if not h.startswith("http://") and not h.startswith("https://"):
                 h = "http://" + h
             url = f"{h}:{int(port)}/printer/info"
-            r = requests.get(url, timeout=10)
+            r = _HTTP.get(url, timeout=(2.0, 3.0))
             r.raise_for_status()
-            _stage_instance = Stage(controller=None, printer_ip=h, port=int(port))
+            StageRegistry.set(Stage(controller=None, printer_ip=h, port=int(port)))
             return "Stage connected.", {"ok": True, "type": "http", "host": h, "port": int(port)}, False
         else:
             return "Select connection type.", None, True
     except Exception as e:
-        _stage_instance = None
+        StageRegistry.set(None)
         msg = str(e)
         if conn_type == "usb":
-            ports = [p.device for p in serial.tools.list_ports.comports()]
+            ports = [dev for dev, _ in _get_ports_cached()]
             msg += (" | Detected ports: " + ", ".join(ports)) if ports else " | No serial ports detected"
         return f"Stage connect failed: {msg}", None, True
 
@@ -253,60 +478,103 @@ def stage_connect(_n, conn_type, host, port, com, baud):
 )
 def stage_connection_indicator(_n):
     try:
-        ok = _stage_instance is not None
-        if ok:
-            if isinstance(_stage_instance, SerialStage):
-                try:
-                    _stage_instance._send("M105")
-                    return "Heartbeat: USB OK"
-                except Exception as e:
-                    return f"Heartbeat: USB write failed: {e}"
+        stage = StageRegistry.get()
+        if stage is not None:
+            if isinstance(stage, SerialStage):
+                # Passive: the M155 autoreport keeps last_rx fresh, no write needed
+                age = time.monotonic() - stage.last_rx
+                return f"Heartbeat: USB OK ({age:.1f}s)" if age < 4.0 else "Heartbeat: stale"
             return "Heartbeat: HTTP OK"
         return "Heartbeat: Not connected"
     except Exception as e:
         return f"Heartbeat error: {e}"
 
+@app.callback(
+    Output("seq-status", "children"),
+    Input("stage-poll", "n_intervals"),
+)
+def show_sequence_status(_n):
+    # Sequences run on a worker thread; surface its last result on the status poll
+    return _seq_status["msg"]
+
+@lru_cache(maxsize=32)
+def _fmt_pocket(name, x, y, z, ts):
+    try:
+        x = int(x); y = int(y); z = int(z)
+    except Exception:
+        return f"{name}: not set"
+    return f"{name}: x={x} µm, y={y} µm, z={z} µm" + (f" (saved {ts})" if ts else "")
+
+def _pocket_text(name, data):
+    if isinstance(data, dict) and all(k in data for k in ("x","y","z")):
+        return _fmt_pocket(name, data.get("x",0), data.get("y",0), data.get("z",0), data.get("ts", ""))
+    return f"{name}: not set"
+
+# One callback per pocket so saving one cup does not re-render the other
 @app.callback(
     Output("pocket-1-display", "children"),
-    Output("pocket-2-display", "children"),
     Input("store-pocket-1", "data"),
+)
+def show_pocket_1(p1):
+    return _pocket_text("Pocket 1", p1)
+
+@app.callback(
+    Output("pocket-2-display", "children"),
     Input("store-pocket-2", "data"),
 )
-def show_pocket_locations(p1, p2):
-    def _fmt(name, data):
-        if isinstance(data, dict) and all(k in data for k in ("x","y","z")):
-            try:
-                x = int(data.get("x",0)); y = int(data.get("y",0)); z = int(data.get("z",0))
-                ts = data.get("ts", "")
-                return f"{name}: x={x} µm, y={y} µm, z={z} µm" + (f" (saved {ts})" if ts else "")
-            except Exception:
-                pass
-        return f"{name}: not set"
-    return _fmt("Pocket 1", p1), _fmt("Pocket 2", p2)
+def show_pocket_2(p2):
+    return _pocket_text("Pocket 2", p2)
 
 @app.callback(
     Output("printer-com", "options"),
     Output("printer-com", "value"),
-    Input("stage-poll", "n_intervals"),
-    State("printer-com", "options"),
+    Input("com-poll", "n_intervals"),
     State("printer-com", "value"),
 )
-def populate_com_dropdown(_n, current_options, current_value):
-    ports = list(serial.tools.list_ports.comports())
-    new_options = [{"label": f"{p.device} — {p.description}", "value": p.device} for p in ports]
-    # If options unchanged, do nothing
-    if isinstance(current_options, list) and current_options == new_options:
+def populate_com_dropdown(n, current_value):
+    # n == 0 is a fresh page load: its dropdown still has the layout default
+    fresh = not n
+    key = _get_ports_cached(0.0 if fresh else _PORTS_TTL)
+    # If the port set is unchanged, do nothing
+    if not fresh and key == _ports_cache["shown"]:
         return no_update, no_update
+    _ports_cache["shown"] = key
+    new_options = [{"label": f"{dev} — {desc}", "value": dev} for dev, desc in key]
     # Preserve current selection if still available
     values = [opt["value"] for opt in new_options]
     new_value = current_value if current_value in values else (values[0] if values else None)
     return new_options, new_value
 
-# Client-side: poll window.dashKeyEvent into store-key
+KEY_DEBOUNCE_S = 0.12
+_last_key_fire = {"ts": 0.0}
+
+# Client-side: a keydown listener pushes arrow presses straight into store-key
+# (set_props), so nothing runs while the keyboard is idle. The handler is
+# throttled (leading edge, 150 ms) so a held arrow key cannot queue up more
+# stage_actions calls than the stage takes. key-init fires once to install it.
 app.clientside_callback(
-    "function(n){ const ev = window.dashKeyEvent; return ev || null; }",
-    Output("store-key", "data"),
-    Input("key-poll", "n_intervals")
+    """
+    function(n){
+        const THROTTLE_MS = 150;
+        if (!window._dashKeyListener) {
+            let lastKeyTs = 0;
+            window._dashKeyListener = function(e){
+                if (!["ArrowLeft", "ArrowRight", "ArrowUp", "ArrowDown"].includes(e.key)) { return; }
+                const tag = (e.target && e.target.tagName) || "";
+                if (tag === "INPUT" || tag === "TEXTAREA" || tag === "SELECT") { return; }
+                e.preventDefault();
+                const now = Date.now();
+                if (now - lastKeyTs < THROTTLE_MS) { return; }
+                lastKeyTs = now;
+                window.dash_clientside.set_props("store-key", {data: {key: e.key, shift: e.shiftKey, ts: now}});
+            };
+            document.addEventListener("keydown", window._dashKeyListener);
+        }
+        return true;
+    }
+    """,
+    Output("key-init", "disabled"),
+    Input("key-init", "n_intervals")
 )
 
 @app.callback(
@@ -339,14 +607,20 @@ app.clientside_callback(
 def stage_actions(key_data, n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown,
                   n_save_p1, n_save_p2, n_goto_p1, n_goto_p2, n_default_cup1, n_default_cup2, n_start_seq,
                   last_ts, jog_um, pause_sec, pocket1, pocket2):
-    global _stage_instance
-    if not _stage_instance:
+    stage = StageRegistry.get()
+    if not stage:
         return "Stage not connected.", last_ts, dash.no_update, dash.no_update
 
     ctx = dash.callback_context
     if not ctx.triggered:
         return no_update, last_ts, dash.no_update, dash.no_update
     which = ctx.triggered[0]['prop_id'].split('.')[0]
+    if which == "store-key":
+        # Second debounce layer behind the browser throttle
+        now = time.monotonic()
+        if now - _last_key_fire["ts"] < KEY_DEBOUNCE_S:
+            return no_update, last_ts, dash.no_update, dash.no_update
+        _last_key_fire["ts"] = now
 
     try:
         step = int(jog_um) if jog_um is not None else 1000
@@ -354,107 +628,155 @@ def stage_actions(key_data, n_home, n_level, nleft, nright, nup, ndown, nzup, nz
         step = 1000
 
     try:
-        if which == "store-key":
-            if not key_data:
-                return no_update, last_ts
-            ts = key_data.get("ts")
-            if last_ts == ts:
-                return no_update, last_ts
-            key = key_data.get("key")
-            shift = bool(key_data.get("shift"))
-            if shift and key == "ArrowUp":
-                _stage_instance.move_z(step)
-                return f"Moved Z by +{step} µm.", ts, dash.no_update, dash.no_update
-            if shift and key == "ArrowDown":
-                _stage_instance.move_z(-step)
-                return f"Moved Z by -{step} µm.", ts, dash.no_update, dash.no_update
-            if key == "ArrowLeft":
-                _stage_instance.move_x(-step)
-                return f"Moved X by -{step} µm.", ts, dash.no_update, dash.no_update
-            if key == "ArrowRight":
-                _stage_instance.move_x(step)
-                return f"Moved X by +{step} µm.", ts, dash.no_update, dash.no_update
-            if key == "ArrowUp":
-                _stage_instance.move_y(step)
-                return f"Moved Y by +{step} µm.", ts, dash.no_update, dash.no_update
-            if key == "ArrowDown":
-                _stage_instance.move_y(-step)
-                return f"Moved Y by -{step} µm.", ts, dash.no_update, dash.no_update
+        # Held across the whole action so the x/y/z update and its G-code go out together
+        with _stage_lock:
+            if _seq_running.is_set() and which not in _SEQ_SAFE_ACTIONS:
+                return "Sequence running; wait for it to finish.", last_ts, dash.no_update, dash.no_update
+            return _dispatch_stage_action(stage, which, key_data, step, last_ts, pause_sec, pocket1, pocket2)
+    except Exception as e:
+        return f"Stage action failed: {e}", last_ts, dash.no_update, dash.no_update
+
+def _jog(axis: str, sign: int):
+    def handler(stage, step):
+        getattr(stage, "move_" + axis)(sign * step)
+        return f"Moved {axis.upper()} by {'+' if sign > 0 else '-'}{step} µm."
+    return handler
+
+def _home(stage, step):
+    stage.move_home((0, 0, 0))
+    return "Homing sent (G28)."
+
+def _level(stage, step):
+    stage.auto_level()
+    return "Auto level sent (G29)."
+
+# Stateless actions: (stage, step) -> status text. Pockets and the sequence stay inline below.
+_ACTIONS = {
+    "btn-stage-home": _home,
+    "btn-stage-level": _level,
+    "btn-left": _jog("x", -1),
+    "btn-right": _jog("x", 1),
+    "btn-up": _jog("y", 1),
+    "btn-down": _jog("y", -1),
+    "btn-z-up": _jog("z", 1),
+    "btn-z-down": _jog("z", -1),
+}
+
+# (key, shift) -> action; Shift+Up/Down drive Z, Shift on Left/Right is ignored
+_KEY_ACTIONS = {
+    ("ArrowLeft", False): _ACTIONS["btn-left"],
+    ("ArrowLeft", True): _ACTIONS["btn-left"],
+    ("ArrowRight", False): _ACTIONS["btn-right"],
+    ("ArrowRight", True): _ACTIONS["btn-right"],
+    ("ArrowUp", False): _ACTIONS["btn-up"],
+    ("ArrowDown", False): _ACTIONS["btn-down"],
+    ("ArrowUp", True): _ACTIONS["btn-z-up"],
+    ("ArrowDown", True): _ACTIONS["btn-z-down"],
+}
+
+_seq_status = {"msg": ""}
+# Set while a sequence streams; motion actions are refused until it clears, without holding _stage_lock
+_seq_running = threading.Event()
+# Actions that only touch the pocket stores, safe while a sequence runs
+_SEQ_SAFE_ACTIONS = {"btn-save-pocket-1", "btn-save-pocket-2", "btn-default-cup-1", "btn-default-cup-2"}
+
+def _run_sequence(stage, prog: list[str], timeout: float):
+    try:
+        acked = stage.run_gcode_program(prog, timeout=timeout)
+    except Exception as e:
+        _seq_status["msg"] = f"Sequence failed: {e}"
+        return
+    finally:
+        _seq_running.clear()
+    if acked < len(prog):
+        _seq_status["msg"] = f"Sequence sent; {acked}/{len(prog)} commands acknowledged."
+    else:
+        _seq_status["msg"] = "Sequence complete."
+
+def _dispatch_stage_action(stage, which, key_data, step, last_ts, pause_sec, pocket1, pocket2):
+    if which == "store-key":
+        if not key_data:
+            return no_update, last_ts, dash.no_update, dash.no_update
+        ts = key_data.get("ts")
+        if last_ts == ts:
             return no_update, last_ts, dash.no_update, dash.no_update
+        handler = _KEY_ACTIONS.get((key_data.get("key"), bool(key_data.get("shift"))))
+        if handler:
+            return handler(stage, step), ts, dash.no_update, dash.no_update
+        return no_update, last_ts, dash.no_update, dash.no_update
 
-        if which == "btn-stage-home":
-            _stage_instance.move_home((0, 0, 0))
-            return "Homing sent (G28).", last_ts, dash.no_update, dash.no_update
-        if which == "btn-stage-level":
-            _stage_instance.auto_level()
-            return "Auto level sent (G29).", last_ts, dash.no_update, dash.no_update
-        if which == "btn-left":
-            _stage_instance.move_x(-step)
-            return f"Moved X by -{step} µm.", last_ts, dash.no_update, dash.no_update
-        if which == "btn-right":
-            _stage_instance.move_x(step)
-            return f"Moved X by +{step} µm.", last_ts, dash.no_update, dash.no_update
-        if which == "btn-up":
-            _stage_instance.move_y(step)
-            return f"Moved Y by +{step} µm.", last_ts, dash.no_update, dash.no_update
-        if which == "btn-down":
-            _stage_instance.move_y(-step)
-            return f"Moved Y by -{step} µm.", last_ts, dash.no_update, dash.no_update
-        if which == "btn-z-down":
-            _stage_instance.move_z(-step)
-            return f"Moved Z by -{step} µm.", last_ts, dash.no_update, dash.no_update
-        if which == "btn-z-up":
-            _stage_instance.move_z(step)
-            return f"Moved Z by +{step} µm.", last_ts, dash.no_update, dash.no_update
-
-        if which == "btn-save-pocket-1":
-            data = {"x": _stage_instance.x, "y": _stage_instance.y, "z": _stage_instance.z, "ts": ts_utc()}
-            return "Saved Cup 1 location.", last_ts, data, dash.no_update
-        if which == "btn-save-pocket-2":
-            data = {"x": _stage_instance.x, "y": _stage_instance.y, "z": _stage_instance.z, "ts": ts_utc()}
-            return "Saved Cup 2 location.", last_ts, dash.no_update, data
-        if which == "btn-goto-pocket-1":
-            if isinstance(pocket1, dict):
-                _stage_instance.goto((int(pocket1.get("x",0)), int(pocket1.get("y",0)), int(pocket1.get("z",0))))
-                return "Moved to Cup 1.", last_ts, dash.no_update, dash.no_update
-            return "Cup 1 not set.", last_ts, dash.no_update, dash.no_update
-        if which == "btn-goto-pocket-2":
-            if isinstance(pocket2, dict):
-                _stage_instance.goto((int(pocket2.get("x",0)), int(pocket2.get("y",0)), int(pocket2.get("z",0))))
-                return "Moved to Cup 2.", last_ts, dash.no_update, dash.no_update
-            return "Cup 2 not set.", last_ts, dash.no_update, dash.no_update
-        if which == "btn-default-cup-1":
-            data = {"x": 86000, "y": 148000, "z": 0, "ts": ts_utc()}
-            return "Default set for Cup 1.", last_ts, data, dash.no_update
-        if which == "btn-default-cup-2":
-            data = {"x": 133000, "y": 70000, "z": 0, "ts": ts_utc()}
-            return "Default set for Cup 2.", last_ts, dash.no_update, data
-        if which == "btn-start-sequence":
-            # Start from Cup 1 if set, move 10 mm per step
-            step = 10000
-            try:
-                p = float(pause_sec) if pause_sec is not None else 2.0
-                if p < 0:
-                    p = 0.0
-            except Exception:
-                p = 2.0
-            # Sequence: down, down, right, up, up, left
-            try:
+    handler = _ACTIONS.get(which)
+    if handler:
+        return handler(stage, step), last_ts, dash.no_update, dash.no_update
+
+    if which == "btn-save-pocket-1":
+        data = {"x": stage.x, "y": stage.y, "z": stage.z, "ts": ts_utc()}
+        return "Saved Cup 1 location.", last_ts, data, dash.no_update
+    if which == "btn-save-pocket-2":
+        data = {"x": stage.x, "y": stage.y, "z": stage.z, "ts": ts_utc()}
+        return "Saved Cup 2 location.", last_ts, dash.no_update, data
+    if which == "btn-goto-pocket-1":
+        if isinstance(pocket1, dict):
+            stage.goto((int(pocket1.get("x",0)), int(pocket1.get("y",0)), int(pocket1.get("z",0))))
+            return "Moved to Cup 1.", last_ts, dash.no_update, dash.no_update
+        return "Cup 1 not set.", last_ts, dash.no_update, dash.no_update
+    if which == "btn-goto-pocket-2":
+        if isinstance(pocket2, dict):
+            stage.goto((int(pocket2.get("x",0)), int(pocket2.get("y",0)), int(pocket2.get("z",0))))
+            return "Moved to Cup 2.", last_ts, dash.no_update, dash.no_update
+        return "Cup 2 not set.", last_ts, dash.no_update, dash.no_update
+    if which == "btn-default-cup-1":
+        data = {"x": 86000, "y": 148000, "z": 0, "ts": ts_utc()}
+        return "Default set for Cup 1.", last_ts, data, dash.no_update
+    if which == "btn-default-cup-2":
+        data = {"x": 133000, "y": 70000, "z": 0, "ts": ts_utc()}
+        return "Default set for Cup 2.", last_ts, dash.no_update, data
+    if which == "btn-start-sequence":
+        # Start from Cup 1 if set, move 10 mm per step
+        step = 10000
+        try:
+            p = float(pause_sec) if pause_sec is not None else 2.0
+            if p < 0:
+                p = 0.0
+        except Exception:
+            p = 2.0
+        # Sequence: down, down, right, up, up, left
+        try:
+            if not hasattr(stage, "run_gcode_program"):
+                # HTTP stage: no raw G-code stream, step through the moves
                 if isinstance(pocket1, dict):
-                    _stage_instance.goto((int(pocket1.get("x",0)), int(pocket1.get("y",0)), int(pocket1.get("z",0))))
+                    stage.goto((int(pocket1.get("x",0)), int(pocket1.get("y",0)), int(pocket1.get("z",0))))
                     time.sleep(p)
-                _stage_instance.move_y(-step); time.sleep(p)
-                _stage_instance.move_y(-step); time.sleep(p)
-                _stage_instance.move_x(step); time.sleep(p)
-                _stage_instance.move_y(step); time.sleep(p)
-                _stage_instance.move_y(step); time.sleep(p)
-                _stage_instance.move_x(-step)
+                stage.move_y(-step); time.sleep(p)
+                stage.move_y(-step); time.sleep(p)
+                stage.move_x(step); time.sleep(p)
+                stage.move_y(step); time.sleep(p)
+                stage.move_y(step); time.sleep(p)
+                stage.move_x(-step)
                 return "Sequence complete.", last_ts, dash.no_update, dash.no_update
-            except Exception as e:
-                return f"Sequence failed: {e}", last_ts, dash.no_update, dash.no_update
-        return no_update, last_ts, dash.no_update, dash.no_update
-    except Exception as e:
-        return f"Stage action failed: {e}", last_ts, dash.no_update, dash.no_update
+            # USB: one program, dwells done by the firmware (G4) instead of time.sleep
+            dwell = f"G4 P{p * 1000:.0f}"
+            x, y, z = stage.x, stage.y, stage.z
+            prog = []
+            if isinstance(pocket1, dict):
+                x = max(0, int(pocket1.get("x",0))); y = max(0, int(pocket1.get("y",0))); z = max(0, int(pocket1.get("z",0)))
+                prog += [f"G0 X{x/1000:.3f} Y{y/1000:.3f} F3000", f"G0 Z{z/1000:.3f} F300", dwell]
+            for dx, dy in ((0, -step), (0, -step), (step, 0), (0, step), (0, step), (-step, 0)):
+                x = max(0, x + dx); y = max(0, y + dy)
+                prog += [f"G0 X{x/1000:.3f} Y{y/1000:.3f} F3000", dwell]
+            prog[-1] = "M400"  # no dwell after the last move; ack only once motion has finished
+            stage.x, stage.y, stage.z = x, y, z
+            _seq_status["msg"] = "Sequence running…"
+            _seq_running.set()
+            try:
+                threading.Thread(target=_run_sequence, args=(stage, prog, 10.0 + 7 * p), daemon=True).start()
+            except Exception:
+                _seq_running.clear()
+                raise
+            return "Sequence queued.", last_ts, dash.no_update, dash.no_update
+        except Exception as e:
+            return f"Sequence failed: {e}", last_ts, dash.no_update, dash.no_update
+    return no_update, last_ts, dash.no_update, dash.no_update
 
 # ---------------------- Run ----------------------
 
@@ -463,14 +785,22 @@ if __name__ == "__main__":
     import webbrowser
 
     HOST = "127.0.0.1"
-    PORT = 8070
+    PORT = find_open_port(DEFAULT_PORT_START)
 
     def _open():
         # open a new tab reliably on Windows
         webbrowser.open(f"http://{HOST}:{PORT}/", new=2, autoraise=True)
 
-    # Give Flask a moment to start before opening the tab
+    # Give the server a moment to start before opening the tab
     threading.Timer(1.2, _open).start()
 
-    app.run_server(debug=False, host=HOST, port=PORT)
+    try:
+        from waitress import serve  # optional; multi-threaded WSGI server
+    except ImportError:
+        serve = None
+    if serve is not None:
+        # Polls keep being answered while another thread waits on the serial port
+        serve(app.server, host=HOST, port=PORT, threads=8)
+    else:
+        app.run(debug=False, host=HOST, port=PORT, threaded=True)
 
@@ -4,10 +4,31 @@
 
 from __future__ import annotations
 import io, json, zipfile, os, socket, webbrowser
+import base64
+import copy
 import time
+import threading
+import queue
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Any, Dict
 import requests, pandas as pd
+from requests.adapters import HTTPAdapter
+import numpy as np
+try:
+    from numba import njit  # optional; compiles the chemistry packing loop
+except ImportError:
+    njit = None
+try:
+    import orjson  # optional; faster parsing/dumping of large analyzer results
+except ImportError:
+    orjson = None
+try:
+    import pyarrow as pa, pyarrow.feather as pa_feather  # optional: Feather spectrum export
+except ImportError:
+    pa = pa_feather = None
 # Ensure we can import local 'sashimi' from the workspace 'particle-scanner' folder
 import sys
 _ps_path = os.path.join(os.getcwd(), "particle-scanner")
@@ -18,13 +39,22 @@ import serial
 import serial.tools.list_ports
 import plotly.graph_objs as go
 import dash
-from dash import Dash, dcc, html, Input, Output, State, no_update
+from dash import Dash, dcc, html, Input, Output, State, no_update, ClientsideFunction
 from dash.exceptions import PreventUpdate  # add this near your other imports
+from flask import request
+try:
+    from flask_sock import Sock  # optional: streams arrow-key jogs over a websocket
+except ImportError:
+    Sock = None
 
 
 APP_TITLE = "SciAps X-550 Basic"
 DEFAULT_PORT_START = 8070
 
+# One pooled keep-alive session so repeated calls to the analyzer reuse the TCP connection
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+
 # ---------------------- Helpers ----------------------
 
 def ts_utc():
@@ -46,43 +76,94 @@ def find_open_port(start_port=DEFAULT_PORT_START):
 def base_url(ip: str, port: int) -> str:
     return f"http://{ip}:{port}/api/v2"
 
+def _json_of(r):
+    return orjson.loads(r.content) if orjson is not None else r.json()
+
+def _json_body(data: Dict[str, Any] | None):
+    # kwargs for a JSON request body, encoded with orjson when available
+    if orjson is None:
+        return {"json": data or {}}
+    return {"data": orjson.dumps(data or {}), "headers": {"Content-Type": "application/json"}}
+
 def api_get(url, **kw):
-    r = requests.get(url, timeout=30, **kw)
+    r = _SESSION.get(url, timeout=kw.pop("timeout", 30), **kw)
     r.raise_for_status()
-    return r.json() if r.headers.get("Content-Type", "").startswith("application/json") else r.content
+    return _json_of(r) if r.headers.get("Content-Type", "").startswith("application/json") else r.content
 
 def api_post(url, data: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None, **kw):
-    r = requests.post(url, params=params or {}, json=data or {}, timeout=kw.get("timeout", 600))
+    r = _SESSION.post(url, params=params or {}, timeout=kw.get("timeout", 600), **_json_body(data))
     try:
         r.raise_for_status()
     except requests.HTTPError as e:
         msg = r.text.strip()
         raise requests.HTTPError(f"{e} | server says: {msg}")
-    return r.json()
+    return _json_of(r)
 
 def api_put(url, data: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None, **kw):
-    r = requests.put(url, params=params or {}, json=data or {}, timeout=kw.get("timeout", 60))
+    r = _SESSION.put(url, params=params or {}, timeout=kw.get("timeout", 60), **_json_body(data))
     try:
         r.raise_for_status()
     except requests.HTTPError as e:
         msg = r.text.strip()
         raise requests.HTTPError(f"{e} | server says: {msg}")
-    return r.json() if r.headers.get("Content-Type", "").startswith("application/json") else r.text
+    return _json_of(r) if r.headers.get("Content-Type", "").startswith("application/json") else r.text
+
+# Element symbol by atomic number (index 0 unused), for a vectorized Z -> symbol gather
+_SYMBOLS = np.array([None,
+    'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P','S','Cl','Ar',
+    'K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr',
+    'Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh','Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe',
+    'Cs','Ba','La','Ce','Pr','Nd','Pm','Sm','Eu','Gd','Tb','Dy','Ho','Er','Tm','Yb','Lu',
+    'Hf','Ta','W','Re','Os','Ir','Pt','Au','Hg','Tl','Pb','Bi','Po','At','Rn',
+    'Fr','Ra','Ac','Th','Pa','U','Np','Pu','Am','Cm','Bk','Cf','Es','Fm','Md','No','Lr',
+    'Rf','Db','Sg','Bh','Hs','Mt','Ds','Rg','Cn','Nh','Fl','Mc','Lv','Ts','Og'], dtype=object)
+
+def _pack(atomic_z, percent, nsym, out_z, out_v, out_i):
+    # Copy rows that carry a reading; unknown atomic numbers map to 0
+    n = 0
+    for i in range(atomic_z.shape[0]):
+        p = percent[i]
+        if p != p:  # NaN: no percent reported
+            continue
+        z = atomic_z[i]
+        out_z[n] = z if 0 < z < nsym else 0
+        out_v[n] = p
+        out_i[n] = i
+        n += 1
+    return n
+
+if njit is not None:
+    _pack = njit(cache=True)(_pack)
+else:
+    def _pack(atomic_z, percent, nsym, out_z, out_v, out_i):
+        keep = np.flatnonzero(~np.isnan(percent))
+        n = keep.size
+        z = atomic_z[keep]
+        out_z[:n] = np.where((z > 0) & (z < nsym), z, 0)
+        out_v[:n] = percent[keep]
+        out_i[:n] = keep
+        return n
+
+def _atomic_z(v):
+    # Same test as the old per-row lookup: ints (bools included) inside the table, anything else -1
+    return int(v) if isinstance(v, int) and 0 < v < len(_SYMBOLS) else -1
 
 def normalize_chemistry(result_json: Dict[str, Any]):
     rows = []
     td = result_json.get("testData")
     if isinstance(td, dict) and isinstance(td.get("chemistry"), list):
-        symbols = [None, 'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P','S','Cl','Ar',
-                   'K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr',
-                   'Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh','Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe']
-        for it in td["chemistry"]:
-            z = it.get("atomicNumber")
-            elem = symbols[z] if isinstance(z, int) and 0 < z < len(symbols) else f"Z{z}"
-            val = it.get("percent")
-            if elem and val is not None:
-                rows.append({"analyte": elem, "value": val, "units": "wt%"})
-        return rows
+        chem = td["chemistry"]
+        n = len(chem)
+        atomic_z = np.fromiter((_atomic_z(it.get("atomicNumber")) for it in chem), np.int32, count=n)
+        # Only marks which rows carry a reading (NaN = None); values are taken from chem as sent
+        present = np.fromiter((np.nan if it.get("percent") is None else 0.0 for it in chem), np.float64, count=n)
+        out_z = np.empty(n, np.int32); out_v = np.empty(n, np.float64); out_i = np.empty(n, np.int64)
+        k = _pack(atomic_z, present, len(_SYMBOLS), out_z, out_v, out_i)
+        analyte = _SYMBOLS[out_z[:k]]
+        for j in np.flatnonzero(out_z[:k] == 0):  # rare: label unknown ids the way the API sent them
+            analyte[j] = f"Z{chem[out_i[j]].get('atomicNumber')}"
+        values = [chem[i]["percent"] for i in out_i[:k].tolist()]
+        return [{"analyte": a, "value": v, "units": "wt%"} for a, v in zip(analyte.tolist(), values)]
     chem = result_json.get("chemistry") or result_json.get("composition")
     if isinstance(chem, dict):
         for k, v in chem.items():
@@ -94,101 +175,142 @@ def normalize_chemistry(result_json: Dict[str, Any]):
             rows.append({"analyte": name, "value": val})
     return rows
 
+def format_chemistry(chem) -> str:
+    # Plain-text table for the summary <pre>; no DataFrame needed just to print
+    names = [str(r.get("analyte") or "") for r in chem]
+    w = max(map(len, names), default=0)
+    lines = []
+    for name, r in zip(names, chem):
+        v = r.get("value")
+        v = f"{v:.3f}" if isinstance(v, (int, float)) and not isinstance(v, bool) else str(v)
+        lines.append(f"{name:<{w}s} {v} {r.get('units', '')}".rstrip())
+    return "\n".join(lines)
+
+SPECTRA_MERGE_AT = 8  # above this many shots, plot them as one None-separated trace
+
+def spectra_figure(spectra) -> go.Figure:
+    # WebGL traces built in one Figure() call; large runs collapse to a single trace
+    if len(spectra) <= SPECTRA_MERGE_AT:
+        return go.Figure(data=[go.Scattergl(x=s['x'], y=s['y'], mode='lines', name=s['shot']) for s in spectra])
+    xs, ys = [], []
+    for s in spectra:
+        xs.extend(s['x']); xs.append(None)
+        ys.extend(s['y']); ys.append(None)
+    return go.Figure(go.Scattergl(x=xs, y=ys, mode='lines', name=f"{len(spectra)} shots", connectgaps=False))
+
 def normalize_spectra(result_json: Dict[str, Any]):
     spectra = []
     specs = result_json.get("spectra")
     if isinstance(specs, list):
         for i, sp in enumerate(specs, start=1):
-            @app.callback(
-                Output("stage-action-status", "children"),
-                Output("store-key-ts", "data"),
-                Input("store-key", "data"),
-                Input("btn-stage-home", "n_clicks"),
-                Input("btn-stage-level", "n_clicks"),
-                Input("btn-left", "n_clicks"),
-                Input("btn-right", "n_clicks"),
-                Input("btn-up", "n_clicks"),
-                Input("btn-down", "n_clicks"),
-                Input("btn-z-up", "n_clicks"),
-                Input("btn-z-down", "n_clicks"),
-                State("store-key-ts", "data"),
-                State("jog-um", "value"),
-                State("store-stage-ready", "data"),
-                prevent_initial_call=True)
-            def stage_actions_combined(key_data, n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown, last_ts, jog_um, ready):
-                global _stage_instance
-                if not ready or not _stage_instance:
-                    return no_update, last_ts
-
-                # Determine what triggered
-                ctx = dash.callback_context
-                if not ctx.triggered:
-                    return no_update, last_ts
-                which = ctx.triggered[0]['prop_id'].split('.')[0]
-
-                # Jog step
-                try:
-                    step = int(jog_um) if jog_um is not None else 1000
-                except Exception:
-                    step = 1000
+            y = sp.get("data") or sp.get("counts")
+            if not y:
+                continue
+            e0 = sp.get("energyOffset", 0.0)
+            slope = sp.get("energySlope", 1.0)
+            # Energy axis in one array op; lists kept because the result goes into a dcc.Store
+            x = (e0 + slope * np.arange(len(y), dtype=np.float64)).tolist()
+            name = sp.get("beamName") or f"beam_{i}"
+            spectra.append({"shot": name, "x": x, "y": y})
+    return spectra
+
+# ---------------------- App ----------------------
+
+app = Dash(__name__)
+app.title = APP_TITLE
+
+app.layout = html.Div([
+    html.H2(APP_TITLE),
+    html.Details([
+        html.Summary("Connection tips (from SciAps RemoteService)"),
+        html.Ul([
+            html.Li("Keep the RemoteService screen visible on the analyzer while using the API."),
+            html.Li("RemoteService listens on the network configured in Android Settings; use the IP shown there (enable 'Show IP')."),
+            html.Li(["USB tethering is simplest: turn Wi‑Fi off and plug USB; IP is ", html.Code("192.168.42.129"), "."]),
+            html.Li(["Wi‑Fi client: join an access point and use the IP shown on the RemoteService screen."]),
+            html.Li([html.Strong("Note:"), " Android portable hotspot showing ", html.Code("192.168.43.1"), " is deprecated on latest EU firmware."]),
+        ], style={"margin": "6px 0"})
+    ], open=False),
+    html.Div([
+        html.Label("Analyzer IP"), dcc.Input(id="ip", value="192.168.42.129", type="text", style={"width": "200px"}),
+        html.Label("Port (scan from)"), dcc.Input(id="port", value="8080", type="number", style={"width": "110px"}),
+        html.Button("USB 192.168.42.129", id="btn-fill-usb"),
+        html.Button("Hotspot 192.168.43.1", id="btn-fill-hotspot"),
+        html.Button("Connect", id="btn-connect"), html.Span(id="connect-status", style={"marginLeft": "10px"}),
+    ], style={"display": "flex", "gap": "8px", "alignItems": "center", "flexWrap": "wrap"}),
 
-                try:
-                    if which == "store-key":
-                        if not key_data:
-                            return no_update, last_ts
-                        ts = key_data.get("ts")
-                        if last_ts == ts:
-                            return no_update, last_ts
-                        key = key_data.get("key")
-                        shift = bool(key_data.get("shift"))
-                        if shift and key == "ArrowUp":
-                            _stage_instance.move_z(step)
-                            return f"Moved Z by +{step} µm.", ts
-                        if shift and key == "ArrowDown":
-                            _stage_instance.move_z(-step)
-                            return f"Moved Z by -{step} µm.", ts
-                        if key == "ArrowLeft":
-                            _stage_instance.move_x(-step)
-                            return f"Moved X by -{step} µm.", ts
-                        if key == "ArrowRight":
-                            _stage_instance.move_x(step)
-                            return f"Moved X by +{step} µm.", ts
-                        if key == "ArrowUp":
-                            _stage_instance.move_y(step)
-                            return f"Moved Y by +{step} µm.", ts
-                        if key == "ArrowDown":
-                            _stage_instance.move_y(-step)
-                            return f"Moved Y by -{step} µm.", ts
-                        return no_update, last_ts
-
-                    # Button actions
-                    if which == "btn-stage-home":
-                        _stage_instance.move_home((0, 0, 0))
-                        return "Homing sent (G28).", last_ts
-                    if which == "btn-stage-level":
-                        _stage_instance.auto_level()
-                        return "Auto level sent (G29).", last_ts
-                    if which == "btn-left":
-                        _stage_instance.move_x(-step)
-                        return f"Moved X by -{step} µm.", last_ts
-                    if which == "btn-right":
-                        _stage_instance.move_x(step)
-                        return f"Moved X by +{step} µm.", last_ts
-                    if which == "btn-up":
-                        _stage_instance.move_y(step)
-                        return f"Moved Y by +{step} µm.", last_ts
-                    if which == "btn-down":
-                        _stage_instance.move_y(-step)
-                        return f"Moved Y by -{step} µm.", last_ts
-                    if which == "btn-z-down":
-                        _stage_instance.move_z(-step)
-                        return f"Moved Z by -{step} µm.", last_ts
-                    if which == "btn-z-up":
-                        _stage_instance.move_z(step)
-                        return f"Moved Z by +{step} µm.", last_ts
-                    return no_update, last_ts
-                except Exception as e:
-                    return f"Stage action failed: {e}", last_ts
+    html.Div(id="live-status", style={"marginTop": "6px", "fontSize": "14px"}),
+    dcc.Interval(id="status-timer", interval=5000, n_intervals=0),  # analyzer status + stage heartbeat + COM list
+    dcc.Store(id="tab-visible", data=True),  # kept current by assets/visibility.js
+
+    html.Hr(),
+
+    # Beam timing editor
+    html.Div([
+        html.H4("Beam Timing (seconds per beam)"),
+        html.Div([
+            html.Label("Seconds per beam"),
+            dcc.Input(id="beam-sec", type="number", min=1, step=1, value=30, style={"width": "100px"}),
+            html.Button("Load Beams", id="btn-load-beams"),
+            html.Span(id="beam-info", style={"marginLeft": "8px"}),
+            html.Button("Apply Beam Times", id="btn-apply-beams", style={"marginLeft": "10px"}),
+            html.Span(id="beam-apply-status", style={"marginLeft": "8px", "fontStyle": "italic"}),
+        ], style={"display": "flex", "gap": "8px", "alignItems": "center", "flexWrap": "wrap"}),
+    ]),
+
+    html.Hr(),
+
+    html.Div([
+        html.Label("Mode"), dcc.Dropdown(id="mode", options=[], placeholder="(connect to load modes)", style={"width": "320px"}),
+        dcc.RadioItems(id="result-kind", options=[{"label": "Final", "value": "final"}, {"label": "All shots", "value": "all"}], value="final", inline=True, style={"marginLeft": "10px"}),
+        html.Button("Analyze (shoot)", id="btn-analyze", n_clicks=0, style={"marginLeft": "10px"}),
+        html.Button("Abort (STOP)", id="btn-abort", n_clicks=0, style={"marginLeft": "6px", "background": "#b00020", "color": "white"}),
+        html.Label("Save folder"), dcc.Input(id="save-folder", type="text", value=os.path.join(os.getcwd(), "x550_runs"), style={"width": "34ch"}),
+        dcc.RadioItems(id="spectrum-format", options=[{"label": "Spectra CSV", "value": "csv"}, {"label": "Spectra Feather", "value": "feather"}], value="csv", inline=True),
+        html.Button("Save Result", id="btn-save", n_clicks=0, style={"marginLeft": "10px"}),
+        html.Span(id="save-status", style={"marginLeft": "8px", "fontStyle": "italic"}),
+    ], style={"display": "flex", "gap": "8px", "alignItems": "center", "flexWrap": "wrap"}),
+
+    html.Div([
+        html.Label("Camera"),
+        dcc.Dropdown(
+            id="camera-id",
+            options=[
+                {"label": "Sample (micro)", "value": "sample"},
+                {"label": "Full view (macro)", "value": "fullview"}
+            ],
+            value="sample",
+            clearable=False,
+            style={"width": "220px"}
+        ),
+        html.Button("📸 Take Photo", id="btn-photo", n_clicks=0),
+    ], style={"display": "flex", "gap": "8px", "alignItems": "center", "flexWrap": "wrap"}),
+
+    html.Img(id="photo-display",
+            style={"maxWidth": "100%", "marginTop": "10px", "border": "1px solid #ccc"}),
+
+
+    html.Pre(id="result-summary", style={"whiteSpace": "pre-wrap", "marginTop": "10px"}),
+    dcc.Graph(id="spectrum-graph"),
+
+    dcc.Store(id="store-base"),
+    dcc.Store(id="store-modes"),
+    dcc.Store(id="store-latest"),
+    dcc.Download(id="download-zip"),
+    dcc.Store(id="store-acq"),
+
+    html.Hr(),
+
+    # ---------------- Stage controls ----------------
+    html.H3("Ender 3 V2 Stage Controls"),
+    dcc.Store(id="store-stage-ready"),
+    dcc.Store(id="store-key"),
+    dcc.Store(id="store-key-ts"),
+    dcc.Store(id="store-jog-um-int", data=1000),  # jog-um validated once, as an int
+    dcc.Store(id="stage-cmd"),  # motion command written by the browser (assets/stage.js)
+    dcc.Store(id="stage-done"),  # {ts[, error]} written by the server once stage-cmd ran
+    dcc.Interval(id="key-poll", interval=200, n_intervals=0),
+    html.Div([
         html.Label("Connection"),
         dcc.Dropdown(id="stage-conn-type", options=[
             {"label":"USB (Serial)", "value":"usb"},
@@ -202,6 +324,7 @@ def normalize_spectra(result_json: Dict[str, Any]):
         dcc.Dropdown(id="printer-com", options=[{"label":"COM4","value":"COM4"}], value="COM4", placeholder="Select COM port", style={"width":"220px"}),
         html.Label("Baud"),
         dcc.Input(id="printer-baud", type="number", value=115200, style={"width":"10ch"}),
+        dcc.Checklist(id="printer-low-latency", options=[{"label": "Low-latency USB", "value": "on"}], value=["on"], inline=True),
         html.Button("Connect Stage", id="btn-stage-connect"),
         html.Span(id="stage-connect-status", style={"marginLeft": "8px"}),
         html.Span(id="stage-conn-heartbeat", style={"marginLeft": "8px", "fontStyle":"italic", "color":"#555"}),
@@ -237,51 +360,45 @@ def normalize_spectra(result_json: Dict[str, Any]):
 def _count_beams(cfg: Dict[str, Any]) -> int:
     if not isinstance(cfg, dict):
         return 0
-    # Newer/minimal schema: arrays at the top level
-    if isinstance(cfg.get("beamTimes"), list):
-        return len(cfg["beamTimes"])
-    # Classic nested schema
-    if isinstance(cfg.get("beams"), list):
-        return len(cfg["beams"])
-    for v in cfg.values():
-        if isinstance(v, dict):
-            n = _count_beams(v)
-            if n:
-                return n
-    return 0
-    if isinstance(cfg.get("beams"), list):
-        return len(cfg["beams"])
-    for v in cfg.values():
-        if isinstance(v, dict):
-            n = _count_beams(v)
-            if n:
-                return n
+    # Depth-first over nested dicts, same order as a recursive walk, without a frame per node
+    stack = deque([cfg])
+    while stack:
+        x = stack.pop()
+        # Newer/minimal schema: arrays at the top level
+        if isinstance(x.get("beamTimes"), list):
+            if x["beamTimes"]:
+                return len(x["beamTimes"])
+            continue
+        # Classic nested schema
+        if isinstance(x.get("beams"), list):
+            if x["beams"]:
+                return len(x["beams"])
+            continue
+        stack.extend(v for v in reversed(x.values()) if isinstance(v, dict))
     return 0
 
 _DURATION_KEYS = {"duration", "durationSec", "durationSecs", "durationSeconds", "testTimeSeconds"}
+_DURATION_KEYS_LOWER = {s.lower() for s in _DURATION_KEYS}
 
 def _set_beam_durations(cfg: Any, dur: int):
     # dur is in SECONDS from the UI
-    if isinstance(cfg, dict):
-        # Minimal schema: list of beamTimes in milliseconds
-        if isinstance(cfg.get("beamTimes"), list):
-            ms = max(1, int(round(dur * 1000)))
-            cfg["beamTimes"] = [ms for _ in cfg["beamTimes"]]
-        # Classic schema
-        if isinstance(cfg.get("beams"), list):
-            for b in cfg["beams"]:
-                if isinstance(b, dict):
-                    for k in list(b.keys()):
-                        if k in _DURATION_KEYS or k.lower() in {s.lower() for s in _DURATION_KEYS}:
-                            b[k] = dur
-                        elif isinstance(b[k], (dict, list)):
-                            _set_beam_durations(b[k], dur)
-        for k, v in cfg.items():
-            if isinstance(v, (dict, list)):
-                _set_beam_durations(v, dur)
-    elif isinstance(cfg, list):
-        for it in cfg:
-            _set_beam_durations(it, dur)
+    stack = deque([cfg])
+    while stack:
+        x = stack.pop()
+        if isinstance(x, dict):
+            # Minimal schema: list of beamTimes in milliseconds
+            if isinstance(x.get("beamTimes"), list):
+                x["beamTimes"] = [max(1, int(round(dur * 1000)))] * len(x["beamTimes"])
+            # Classic schema
+            if isinstance(x.get("beams"), list):
+                for b in x["beams"]:
+                    if isinstance(b, dict):
+                        for k in b:
+                            if k.lower() in _DURATION_KEYS_LOWER:
+                                b[k] = dur
+            stack.extend(v for v in x.values() if isinstance(v, (dict, list)))
+        elif isinstance(x, list):
+            stack.extend(v for v in x if isinstance(v, (dict, list)))
 
 # Load current acquisition parameters for selected mode
 @app.callback(
@@ -322,14 +439,15 @@ def apply_beams(_n, sec, cfg, base, mode):
         return "Load beams first."
     try:
         sec = float(sec)
-        new_cfg = json.loads(json.dumps(cfg))  # deep copy
-        if isinstance(new_cfg.get("beamTimes"), list):
-            # Minimal schema: update ms directly and keep existing flags/testType
+        if isinstance(cfg.get("beamTimes"), list):
+            # Minimal schema: only beamTimes changes, so a shallow rebuild is enough;
+            # existing flags/testType are kept as-is
             ms = max(1, int(round(sec * 1000)))
-            new_cfg["beamTimes"] = [ms for _ in new_cfg["beamTimes"]]
+            new_cfg = {**cfg, "beamTimes": [ms] * len(cfg["beamTimes"])}
             api_put(base + "/acquisitionParams/user", params={"mode": mode}, data=new_cfg)
             return f"Applied {sec:g}s per beam to mode '{mode}'. (beamTimes in ms)"
-        # Classic schema path
+        # Classic schema path: durations are nested, so copy the whole tree first
+        new_cfg = copy.deepcopy(cfg)
         _set_beam_durations(new_cfg, sec)
         api_put(base + "/acquisitionParams/user", params={"mode": mode}, data=new_cfg)
         return f"Applied {int(sec)}s per beam to mode '{mode}'."
@@ -355,44 +473,52 @@ def fill_ip(n_usb, n_hot, current):
     Output("store-modes", "data"),
     Output("mode", "options"),
     Output("mode", "value"),
-    Output("status-timer", "disabled"),
     Input("btn-connect", "n_clicks"), State("ip", "value"), State("port", "value"),
     prevent_initial_call=True)
 def connect(n, ip, port):
     try:
         start = int(port) if str(port).isdigit() else 8080
         info = None; chosen = None
-        for try_p in range(start, start + 10):
-            for path in ("/api/v2/id", "/api/v1/id", "/api/id"):
-                url = f"http://{ip}:{try_p}{path}"
+        # Probe every port/path at once, but take the answers in scan order (lowest port, then
+        # v2, v1, bare), so the same analyzer is picked as by the old one-by-one loop
+        urls = [f"http://{ip}:{p}{path}" for p in range(start, start + 10)
+                for path in ("/api/v2/id", "/api/v1/id", "/api/id")]
+
+        def probe(url):
+            r = requests.get(url, timeout=2)
+            r.raise_for_status()
+            if not (r.headers.get("Content-Type", "").startswith("application/json") or r.text.startswith("{")):
+                raise ValueError("not a JSON API")
+            return r.json()
+
+        ex = ThreadPoolExecutor(max_workers=16)
+        try:
+            futs = [ex.submit(probe, u) for u in urls]
+            for url, fut in zip(urls, futs):
                 try:
-                    r = requests.get(url, timeout=5)
-                    r.raise_for_status()
-                    if r.headers.get("Content-Type", "").startswith("application/json") or r.text.startswith("{"):
-                        info = r.json(); chosen = f"http://{ip}:{try_p}" + path.rsplit("/", 1)[0]
-                        break
+                    info = fut.result()
                 except Exception:
                     continue
-            if chosen:
+                chosen = url.rsplit("/", 1)[0]
                 break
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
         if not chosen:
-            return (f"Connect failed: no API found. Make sure the analyzer shows the RemoteService screen with an IP (enable 'Show IP'), then use that IP. Searched {ip}:{start}-{start+9}", None, None, [], None, True)
+            return (f"Connect failed: no API found. Make sure the analyzer shows the RemoteService screen with an IP (enable 'Show IP'), then use that IP. Searched {ip}:{start}-{start+9}", None, None, [], None)
         apps = info.get("apps", []) if isinstance(info, dict) else []
         options = [{"label": a, "value": a} for a in apps] if apps else []
         default_mode = options[0]["value"] if options else None
-        return f"Connected: {info.get('family', 'X-550')} | Base: {chosen}", chosen, apps, options, default_mode, False
+        return f"Connected: {info.get('family', 'X-550')} | Base: {chosen}", chosen, apps, options, default_mode
     except Exception as e:
-        return f"Connect failed: {e}", None, None, [], None, True
+        return f"Connect failed: {e}", None, None, [], None
 
-@app.callback(
-    Output("live-status", "children"),
-    Input("status-timer", "n_intervals"), State("store-base", "data"),
-    prevent_initial_call=True)
-def poll_status(_n, base):
-    if not base:
-        return no_update
+# (connect, read) for the status poll: it shares a callback with the stage heartbeat and COM
+# refresh, so a hung analyzer must give up well inside one 5 s tick
+STATUS_TIMEOUT = (1.5, 2.5)
+
+def _analyzer_status(base):
     try:
-        s = api_get(base + "/status")
+        s = api_get(base + "/status", timeout=STATUS_TIMEOUT)
 
         # --- Battery (support multiple schemas) ---
         batt = None
@@ -462,10 +588,8 @@ def analyze(n, base, mode, kind):
         res = api_post(base + ep, params={"mode": mode} if mode else {})
         chem = normalize_chemistry(res)
         spectra = normalize_spectra(res)
-        summary = pd.DataFrame(chem).to_string(index=False) if chem else "(no chemistry data)"
-        fig = go.Figure()
-        for s in spectra:
-            fig.add_trace(go.Scatter(x=s['x'], y=s['y'], mode='lines', name=s['shot']))
+        summary = format_chemistry(chem) if chem else "(no chemistry data)"
+        fig = spectra_figure(spectra)
         payload = {"ts": ts_utc(), "mode": mode or "", "result_raw": res, "chem_rows": chem, "spectra": spectra}
         return summary, fig, payload
     except Exception as e:
@@ -474,35 +598,48 @@ def analyze(n, base, mode, kind):
 @app.callback(
     Output("download-zip", "data"), Output("save-status", "children"),
     Input("btn-save", "n_clicks"), State("store-latest", "data"), State("save-folder", "value"),
+    State("spectrum-format", "value"),
     prevent_initial_call=True)
-def save_latest(_n, payload, save_dir):
+def save_latest(_n, payload, save_dir, spec_fmt):
     if not payload:
         return no_update, "No result in memory. Run Analyze first."
     result_raw = payload.get("result_raw", {})
     chem_rows = payload.get("chem_rows") or normalize_chemistry(result_raw) or []
     spectra = payload.get("spectra") or normalize_spectra(result_raw) or []
 
-    mem = io.BytesIO()
-    with zipfile.ZipFile(mem, 'w', zipfile.ZIP_DEFLATED) as zf:
+    out_dir = save_dir or os.path.join(os.getcwd(), "x550_runs")
+    os.makedirs(out_dir, exist_ok=True)
+    fname = f"sciaps_{(payload.get('mode', 'mode') or 'mode').lower()}_{payload.get('ts', ts_utc())}.zip"
+    out_path = os.path.join(out_dir, fname)
+
+    # Write the archive straight to disk and send that file; no in-memory copy.
+    # Level 1: a little larger than the default 6 but several times faster on big spectra
+    with zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
         ts = payload.get("ts", ts_utc()); mode = payload.get("mode", "mode")
-        zf.writestr(f"result_{mode}_{ts}.json", json.dumps(result_raw, indent=2))
+        raw = orjson.dumps(result_raw, option=orjson.OPT_INDENT_2) if orjson is not None else json.dumps(result_raw, indent=2)
+        zf.writestr(f"result_{mode}_{ts}.json", raw)
         if chem_rows:
             dfc = pd.DataFrame(chem_rows)
             zf.writestr(f"chemistry_{mode}_{ts}.csv", dfc.to_csv(index=False))
+        use_feather = spec_fmt == "feather" and pa is not None
         for s in spectra:
             name = (s.get("shot") or "final").replace(" ", "_")
-            dfs = pd.DataFrame({"channel": s.get("x", []), "counts": s.get("y", [])})
-            zf.writestr(f"spectrum_{name}_{ts}.csv", dfs.to_csv(index=False))
-    mem.seek(0)
-
-    out_dir = save_dir or os.path.join(os.getcwd(), "x550_runs")
-    os.makedirs(out_dir, exist_ok=True)
-    fname = f"sciaps_{(payload.get('mode', 'mode') or 'mode').lower()}_{payload.get('ts', ts_utc())}.zip"
-    out_path = os.path.join(out_dir, fname)
-    with open(out_path, 'wb') as f:
-        f.write(mem.getvalue())
+            if use_feather:
+                # Binary columns straight from the arrays, no text formatting
+                tbl = pa.table({"channel": np.asarray(s.get("x", []), dtype=np.float64),
+                                "counts": np.asarray(s.get("y", []))})
+                buf = io.BytesIO()
+                pa_feather.write_feather(tbl, buf)
+                zf.writestr(f"spectrum_{name}_{ts}.feather", buf.getvalue())
+            else:
+                buf = io.StringIO()
+                np.savetxt(buf, np.column_stack([np.asarray(s.get("x", []), dtype=np.float64),
+                                                 np.asarray(s.get("y", []), dtype=np.float64)]),
+                           fmt="%.10g", delimiter=",", header="channel,counts", comments="")
+                zf.writestr(f"spectrum_{name}_{ts}.csv", buf.getvalue())
 
-    return dcc.send_bytes(mem.getvalue(), filename=fname), f"Saved to: {out_path} — and download sent."
+    note = " (pyarrow not installed; spectra saved as CSV)" if spec_fmt == "feather" and pa is None else ""
+    return dcc.send_file(out_path, filename=fname), f"Saved to: {out_path} — and download sent.{note}"
 
 @app.callback(
     Output("photo-display", "src"),
@@ -515,11 +652,19 @@ def take_photo(n, base, camera_id):
     if not base:
         return no_update
     try:
-        r = requests.get(f"{base}/photo", params={"cameraId": camera_id}, timeout=15)
-        r.raise_for_status()
-        import base64
-        b64 = base64.b64encode(r.content).decode("utf-8")
-        return f"data:image/jpeg;base64,{b64}"
+        # Stream the JPEG and encode it chunkwise into one buffer behind the data-URL prefix
+        with _SESSION.get(f"{base}/photo", params={"cameraId": camera_id}, timeout=15, stream=True) as r:
+            r.raise_for_status()
+            buf = bytearray(b"data:image/jpeg;base64,")
+            tail = b""
+            for chunk in r.iter_content(chunk_size=3 * 65536):
+                if tail:
+                    chunk = tail + chunk
+                cut = len(chunk) - len(chunk) % 3  # whole 3-byte groups only, so no padding mid-stream
+                buf += base64.b64encode(memoryview(chunk)[:cut])
+                tail = chunk[cut:]
+            buf += base64.b64encode(tail)
+        return buf.decode("ascii")
     except Exception as e:
         print("Photo capture failed:", e)
         return no_update
@@ -527,9 +672,50 @@ def take_photo(n, base, camera_id):
 
 # ---------------------- Stage Controls ----------------------
 
+JOG_COALESCE_S = 0.02  # window for merging jog moves into one G0
+
+@lru_cache(maxsize=4096)
+def _um_to_mm_trimmed(um: int) -> bytes:
+    # Only the digits the 1 µm resolution needs: 12000 -> b"12", 1500 -> b"1.5"
+    return (b"%.3f" % (um / 1000)).rstrip(b"0").rstrip(b".")
+
+_AXIS_WORD = {"x": b" X", "y": b" Y", "z": b" Z"}
+# Fixed lines and templates, encoded once; shorter lines leave more room in RX_BUF
+_M115 = b"M115\r\n"
+_M105 = b"M105\r\n"
+_G28 = b"G28\r\n"
+_G29 = b"G29\r\n"
+_GOTO_TPL = {"x": b"G0 X%s F3000\r\n", "y": b"G0 Y%s F3000\r\n", "z": b"G0 Z%s F300\r\n"}
+
+# Character-counting sender: keep the firmware RX buffer full without waiting
+# for each "ok". Marlin's default RX buffer is 64 bytes (Grbl: 128).
+RX_BUF = 64
+RX_MARGIN = 4
+TX_STALL_S = 10.0  # no reply at all for this long: assume lost acks and stop counting them
+STAGE_HEARTBEAT_S = 2.0  # idle link: the sender injects an M105 this often
+
+def _set_low_latency(ser) -> str | None:
+    """Ask the USB-serial driver for 1 ms latency; returns "before→after ms" when known."""
+    try:
+        ser.set_low_latency_mode(True)  # ASYNC_LOW_LATENCY ioctl; Linux only
+    except (AttributeError, NotImplementedError, OSError, ValueError):
+        pass
+    # FTDI-style drivers keep their own timer; set it directly when sysfs exposes it
+    path = f"/sys/bus/usb-serial/devices/{os.path.basename(os.path.realpath(ser.port))}/latency_timer"
+    try:
+        with open(path) as f:
+            before = f.read().strip()
+        if before != "1":
+            with open(path, "w") as f:
+                f.write("1")
+        with open(path) as f:
+            return f"{before}→{f.read().strip()} ms"
+    except OSError:
+        return None
+
 # Keep a module-level reference for the Stage instance
 class SerialStage:
-    def __init__(self, com_port: str, baud: int = 115200):
+    def __init__(self, com_port: str, baud: int = 115200, low_latency: bool = True):
         # Robust CH340 init: 8N1, toggle DTR/RTS, flush buffers
         self.ser = serial.Serial(
             com_port,
@@ -549,64 +735,290 @@ class SerialStage:
             self.ser.rts = True
         except Exception:
             pass
+        self.latency = _set_low_latency(self.ser) if low_latency else None
         # Clear any bootloader text
         try:
             self.ser.reset_input_buffer()
             self.ser.reset_output_buffer()
         except Exception:
             pass
+        # Replies are read on a background thread and lines go out from a sender
+        # thread: fire-and-forget commands (jogs, heartbeat) never wait, _send_sync
+        # waits for its own "ok". Every queued line is (bytes, waiter, jog axes).
+        self._write_lock = threading.Lock()
+        self._tx_cond = threading.Condition()
+        self._tx_queue: deque[tuple[bytes, queue.Queue | None, frozenset]] = deque()
+        self._tx_inflight: deque[tuple[int, queue.Queue | None]] = deque()  # sent, "ok" still due
+        self._tx_outstanding = 0  # bytes sitting in the firmware RX buffer
+        self._last_rx = self._last_tx = time.monotonic()
+        threading.Thread(target=self._reader, daemon=True).start()
+        threading.Thread(target=self._sender, daemon=True).start()
         # Probe firmware to ensure link is live
-        self._send("M115")  # request firmware info
+        self._send_sync(_M115)  # request firmware info
         # positions tracked in µm for consistency with existing UI
         self.x = 0
         self.y = 0
         self.z = 0
+        # Jog coalescing: axes moved since the last flush, sent as one G0
+        self._pending: set[str] = set()
+        self._flush_timer: threading.Timer | None = None
+        self._jog_lock = threading.Lock()
 
-    def _send(self, cmd: str) -> str:
-        data = (cmd.strip() + "\r\n").encode("ascii")
-        self.ser.write(data)
-        self.ser.flush()
-        # read simple response up to newline
-        resp = b""
+    def _reader(self):
+        while self.ser.is_open:
+            try:
+                line = self.ser.readline().decode(errors="ignore").strip()
+            except Exception:
+                break
+            if line:
+                self._last_rx = time.monotonic()
+            if not line.startswith("ok"):
+                continue
+            # Acks come back in command order: each frees the oldest line's bytes
+            with self._tx_cond:
+                if not self._tx_inflight:
+                    continue
+                n, waiter = self._tx_inflight.popleft()
+                self._tx_outstanding -= n
+                self._tx_cond.notify()
+            if waiter is not None:
+                waiter.put(line)
+
+    def _sender(self):
+        budget = RX_BUF - RX_MARGIN
+        while self.ser.is_open:
+            with self._tx_cond:
+                while not self._tx_queue or (
+                        self._tx_inflight and self._tx_outstanding + len(self._tx_queue[0][0]) > budget):
+                    self._tx_cond.wait(0.5)
+                    now = time.monotonic()
+                    if self._tx_inflight and now - self._last_rx > TX_STALL_S:
+                        self._tx_inflight.clear()
+                        self._tx_outstanding = 0
+                    elif not self._tx_queue and not self._tx_inflight and now - self._last_tx >= STAGE_HEARTBEAT_S:
+                        self._tx_queue.append((_M105, None, frozenset()))  # keep last_rx fresh
+                # Take every queued line that still fits; one write for all of them
+                batch = []
+                while self._tx_queue:
+                    data, waiter, _ = self._tx_queue[0]
+                    if self._tx_inflight and self._tx_outstanding + len(data) > budget:
+                        break
+                    self._tx_queue.popleft()
+                    self._tx_inflight.append((len(data), waiter))
+                    self._tx_outstanding += len(data)
+                    batch.append(data)
+            try:
+                with self._write_lock:
+                    self.ser.write(b"".join(batch))
+                    self.ser.flush()
+                self._last_tx = time.monotonic()
+            except Exception:
+                break
+
+    @property
+    def last_rx(self) -> float:
+        """time.monotonic() of the last line received from the firmware."""
+        return self._last_rx
+
+    def _enqueue(self, cmd: str | bytes, waiter: queue.Queue | None = None, axes: frozenset = frozenset()):
+        # Hot paths pass ready-made bytes lines; plain commands are encoded here
+        data = cmd if isinstance(cmd, bytes) else (cmd.strip() + "\r\n").encode("ascii")
+        with self._tx_cond:
+            # An unsent jog whose axes the new absolute jog also sets is superseded by it
+            if axes and self._tx_queue and self._tx_queue[-1][2] and self._tx_queue[-1][2] <= axes:
+                self._tx_queue.pop()
+            self._tx_queue.append((data, waiter, axes))
+            self._tx_cond.notify()
+
+    def _send_async(self, cmd: str | bytes):
+        self._enqueue(cmd)
+
+    def _send_sync(self, cmd: str | bytes, timeout: float = 2.0) -> str:
+        waiter: queue.Queue = queue.Queue(maxsize=1)
+        self._enqueue(cmd, waiter)
         try:
-            resp = self.ser.readline()
-        except Exception:
-            pass
-        return resp.decode(errors="ignore")
+            return waiter.get(timeout=timeout)
+        except queue.Empty:
+            return ""
 
     def move_home(self, home_position=(0,0,0)):
-        self._send("G28")
+        self._flush_jog()  # pending jogs go out before the homing move
+        self._send_sync(_G28)
         self.goto(home_position)
 
     def auto_level(self):
-        self._send("G29")
+        self._flush_jog()
+        self._send_sync(_G29)
 
+    # Relative jogs update the tracked position right away but are sent together
+    # after JOG_COALESCE_S, so a burst of presses becomes one G0 line
     def move_x(self, distance_um: int):
-        self.goto_x(self.x + distance_um)
+        self._jog("x", self.x + distance_um)
 
     def move_y(self, distance_um: int):
-        self.goto_y(self.y + distance_um)
+        self._jog("y", self.y + distance_um)
 
     def move_z(self, distance_um: int):
-        self.goto_z(self.z + distance_um)
+        self._jog("z", self.z + distance_um)
+
+    def move_xy(self, dx_um: int, dy_um: int):
+        # Diagonal press: both axes land in the same coalesced G0
+        with self._jog_lock:
+            self.x = max(0, self.x + dx_um)
+            self.y = max(0, self.y + dy_um)
+            self._pending.update("xy")
+            self._arm_flush()
+
+    def _jog(self, axis: str, position_um: int):
+        with self._jog_lock:
+            setattr(self, axis, max(0, position_um))
+            self._pending.add(axis)
+            self._arm_flush()
+
+    def _arm_flush(self):
+        # Caller holds _jog_lock
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(JOG_COALESCE_S, self._flush_jog)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush_jog(self):
+        with self._jog_lock:
+            axes, self._pending = self._pending, set()
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()  # no-op when this is the timer itself
+                self._flush_timer = None
+            if not axes:
+                return
+            line = b"G0" + b"".join(_AXIS_WORD[a] + _um_to_mm_trimmed(getattr(self, a)) for a in "xyz" if a in axes)
+            self._enqueue(line + (b" F300\r\n" if "z" in axes else b" F3000\r\n"), axes=frozenset(axes))
 
     def goto_x(self, position_um: int):
+        self._flush_jog()  # keep absolute moves behind any pending jog
         self.x = max(0, position_um)
-        self._send(f"G0 X {self.x/1000:.3f} F3000")
+        self._send_async(_GOTO_TPL["x"] % _um_to_mm_trimmed(self.x))
 
     def goto_y(self, position_um: int):
+        self._flush_jog()
         self.y = max(0, position_um)
-        self._send(f"G0 Y {self.y/1000:.3f} F3000")
+        self._send_async(_GOTO_TPL["y"] % _um_to_mm_trimmed(self.y))
 
     def goto_z(self, position_um: int):
+        self._flush_jog()
         self.z = max(0, position_um)
-        self._send(f"G0 Z {self.z/1000:.3f} F300")
+        self._send_async(_GOTO_TPL["z"] % _um_to_mm_trimmed(self.z))
 
     def goto(self, pos):
         self.goto_x(pos[0]); self.goto_y(pos[1]); self.goto_z(pos[2])
 
 _stage_instance: object | None = None
 
+# comports() costs ~100 ms on Windows; re-enumerate at most every _PORTS_TTL seconds,
+# or sooner on POSIX when /dev changes (a tty node was added or removed)
+_PORTS_TTL = 5.0
+_PORTS_CACHE: tuple[float, int | None, list] = (0.0, None, [])
+
+def _ports_signal() -> int | None:
+    try:
+        return os.stat("/dev").st_mtime_ns if os.name == "posix" else None
+    except OSError:
+        return None
+
+def _comports():
+    global _PORTS_CACHE
+    ts, sig, ports = _PORTS_CACHE
+    now = time.monotonic()
+    cur = _ports_signal()
+    if not ts or now - ts >= _PORTS_TTL or cur != sig:
+        ports = list(serial.tools.list_ports.comports())
+        _PORTS_CACHE = (now, cur, ports)
+    return ports
+
+# ---------------------- Stage command queue ----------------------
+# Callbacks and the /stage websocket only enqueue; one worker thread talks to
+# the stage, so no Dash worker waits on the serial link. Jogs that piled up
+# are merged into one move per axis (X+Y together as a diagonal).
+
+_stage_cmd_q: "queue.Queue[tuple[str, int, int, int]]" = queue.Queue(maxsize=256)  # (action, dx, dy, dz)
+_stage_thread: threading.Thread | None = None
+
+def _run_jog(stage, dx: int, dy: int, dz: int):
+    if dx and dy and hasattr(stage, "move_xy"):
+        stage.move_xy(dx, dy)
+    else:
+        if dx:
+            stage.move_x(dx)
+        if dy:
+            stage.move_y(dy)
+    if dz:
+        stage.move_z(dz)
+
+def _run_home(stage, *_):
+    stage.move_home((0, 0, 0))
+
+def _run_level(stage, *_):
+    stage.auto_level()
+
+_STAGE_ACTIONS = {"jog": _run_jog, "home": _run_home, "level": _run_level}
+
+def _stage_worker():
+    held = None  # a non-jog command met while merging jogs
+    while True:
+        action, dx, dy, dz = held or _stage_cmd_q.get()
+        held = None
+        if action == "jog":
+            while True:
+                try:
+                    nxt = _stage_cmd_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt[0] != "jog":
+                    held = nxt
+                    break
+                dx += nxt[1]; dy += nxt[2]; dz += nxt[3]
+        stage = _stage_instance
+        if stage is None:
+            continue
+        try:
+            _STAGE_ACTIONS[action](stage, dx, dy, dz)
+        except Exception as e:
+            print(f"[stage] {action} failed: {e}")
+
+def _start_stage_worker():
+    global _stage_thread
+    if _stage_thread is None or not _stage_thread.is_alive():
+        _stage_thread = threading.Thread(target=_stage_worker, daemon=True)
+        _stage_thread.start()
+
+if Sock is not None:
+    _sock = Sock(app.server)
+
+    @_sock.route("/stage")
+    def stage_socket(ws):
+        # Browsers don't apply same-origin rules to websocket handshakes, so only this app's
+        # own page may drive the stage; any other (or missing) Origin is closed unread
+        if request.headers.get("Origin") != request.host_url.rstrip("/"):
+            ws.close(1008, "origin not allowed")
+            return
+        # Frames are {"axis": "x"|"y"|"z", "d": µm}; each is answered with a status line
+        while True:
+            try:
+                msg = json.loads(ws.receive())
+                axis, d = msg.get("axis"), int(msg.get("d") or 0)
+            except (ValueError, TypeError, AttributeError):
+                continue
+            if axis not in ("x", "y", "z") or not d:
+                continue
+            if _stage_instance is None:
+                ws.send("Stage not connected.")
+                continue
+            try:
+                _stage_cmd_q.put_nowait(("jog", d if axis == "x" else 0, d if axis == "y" else 0, d if axis == "z" else 0))
+            except queue.Full:
+                ws.send("Stage busy: move dropped.")
+                continue
+            ws.send(f"Moved {axis.upper()} by {d:+d} µm.")
+
 @app.callback(
     Output("stage-connect-status", "children"),
     Output("store-stage-ready", "data"),
@@ -616,8 +1028,9 @@ _stage_instance: object | None = None
     State("printer-port", "value"),
     State("printer-com", "value"),
     State("printer-baud", "value"),
+    State("printer-low-latency", "value"),
     prevent_initial_call=True)
-def stage_connect(_n, conn_type, host, port, com, baud):
+def stage_connect(_n, conn_type, host, port, com, baud, low_latency):
     global _stage_instance
     try:
         print(f"[stage_connect] click={_n} type={conn_type} host={host} port={port} com={com} baud={baud}")
@@ -628,7 +1041,7 @@ def stage_connect(_n, conn_type, host, port, com, baud):
             return "Click to connect…", dash.no_update
         if conn_type == "usb":
             if not com:
-                ports = [p.device for p in serial.tools.list_ports.comports()]
+                ports = [p.device for p in _comports()]
                 # Fallback to COM4 if detected earlier or user reported
                 fallback = "COM4" if (not ports or "COM4" in ports) else (ports[0] if ports else None)
                 if fallback is None:
@@ -639,7 +1052,8 @@ def stage_connect(_n, conn_type, host, port, com, baud):
             b = int(baud) if baud else 115200
             # Show connecting status
             print("[stage_connect] Opening serial port…")
-            _stage_instance = SerialStage(com_port=com, baud=b)
+            _stage_instance = SerialStage(com_port=com, baud=b, low_latency="on" in (low_latency or []))
+            _start_stage_worker()
             print(f"[stage_connect] USB connected on {com} @ {b}")
             return f"Stage connected via USB on {com} @ {b} baud.", {"ok": True, "type": "usb", "com": com, "baud": b}
         elif conn_type == "http":
@@ -649,9 +1063,10 @@ def stage_connect(_n, conn_type, host, port, com, baud):
             if not h.startswith("http://") and not h.startswith("https://"):
                 h = "http://" + h
             url = f"{h}:{int(port)}/printer/info"
-            r = requests.get(url, timeout=10)
+            r = _SESSION.get(url, timeout=10)
             r.raise_for_status()
             _stage_instance = Stage(controller=None, printer_ip=h, port=int(port))
+            _start_stage_worker()
             print(f"[stage_connect] HTTP connected to {h}:{int(port)}")
             return "Stage connected.", {"ok": True, "type": "http", "host": h, "port": int(port)}
         else:
@@ -660,7 +1075,7 @@ def stage_connect(_n, conn_type, host, port, com, baud):
         _stage_instance = None
         msg = str(e)
         if conn_type == "usb":
-            ports = [p.device for p in serial.tools.list_ports.comports()]
+            ports = [p.device for p in _comports()]
             if ports:
                 msg += f" | Detected ports: {', '.join(ports)}"
             else:
@@ -668,139 +1083,133 @@ def stage_connect(_n, conn_type, host, port, com, baud):
         print(f"[stage_connect] FAILED: {msg}")
         return f"Stage connect failed: {msg}", None
 
-# Continuously reflect connection state in a heartbeat label
-@app.callback(
-    Output("stage-conn-heartbeat", "children"),
-    Input("stage-poll", "n_intervals"),
-)
-def stage_connection_indicator(_n):
+def _stage_heartbeat():
     try:
-        # Update COM dropdown options
-        ports = [
-            {"label": f"{p.device} — {p.description}", "value": p.device}
-            for p in serial.tools.list_ports.comports()
-        ]
-        # Send options to component via clientside callback (add below)
         ok = _stage_instance is not None
         if ok:
-            # Try a lightweight NO-OP write on serial to ensure port is open
+            # The sender thread keeps the link busy with M105; just report when it last answered
             if isinstance(_stage_instance, SerialStage):
-                try:
-                    _stage_instance._send("M105")  # temperature query, safe
-                    return "Heartbeat: USB OK"
-                except Exception as e:
-                    return f"Heartbeat: USB write failed: {e}"
+                age = time.monotonic() - _stage_instance.last_rx
+                if age > 3 * STAGE_HEARTBEAT_S + 1:
+                    return f"Heartbeat: USB silent for {age:.0f} s"
+                lat = _stage_instance.latency
+                msg = f"Heartbeat: USB OK @ {age * 1000:.0f} ms ago"
+                return f"{msg} | latency_timer {lat}" if lat else msg
             return "Heartbeat: HTTP OK"
         return "Heartbeat: Not connected"
     except Exception as e:
         return f"Heartbeat error: {e}"
 
+# One timer for everything periodic: analyzer status, stage heartbeat and COM list
 @app.callback(
+    Output("live-status", "children"),
+    Output("stage-conn-heartbeat", "children"),
     Output("printer-com", "options"),
     Output("printer-com", "value"),
-    Input("stage-poll", "n_intervals"),
+    Input("status-timer", "n_intervals"),
+    Input("tab-visible", "data"),  # refresh at once when the tab is shown again
+    State("store-base", "data"),
+    State("printer-com", "value"),
+    State("printer-com", "options"),
     prevent_initial_call=False)
-def populate_com_dropdown(_n):
-    ports = list(serial.tools.list_ports.comports())
+def poll_status(_n, visible, base, com, shown):
+    if visible is False:
+        raise PreventUpdate
+    live = _analyzer_status(base) if base else no_update
+    ports = _comports()
     options = [{"label": f"{p.device} — {p.description}", "value": p.device} for p in ports]
-    value = options[0]["value"] if options else None
-    return options, value
+    devices = [o["value"] for o in options]
+    value = no_update if com in devices else (devices[0] if devices else no_update)
+    # Same list as the browser already shows: leave the dropdown alone
+    return live, _stage_heartbeat(), (no_update if options == shown else options), value
+
+# Nobody reads the status line of a hidden tab: stop the timer until it is shown again
+app.clientside_callback(
+    ClientsideFunction(namespace="visibility", function_name="pollDisabled"),
+    Output("status-timer", "disabled"),
+    Input("tab-visible", "data"),
+)
 
-# Key polling: clientside reads window.dashKeyEvent and updates store
+# Key polling: clientside installs the arrow-key listener once, then hands
+# window.dashKeyEvent to store-key on each tick. When the server offers the
+# /stage websocket (flask-sock installed) presses go over it instead.
+# Held keys are throttled here, before anything reaches the server.
 app.clientside_callback(
-    "function(n){\n      const ev = window.dashKeyEvent;\n      return ev || null;\n    }",
+    """
+    function(n){
+        if (!window._stageWsTried && window.WebSocket) {
+            window._stageWsTried = true;
+            const ws = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/stage");
+            ws.onopen = function(){ window._stageWs = ws; };
+            ws.onmessage = function(ev){
+                window.dash_clientside.set_props("stage-action-status", {children: ev.data});
+            };
+            ws.onclose = function(){ window._stageWs = null; };
+        }
+        if (!window._dashKeyListener) {
+            const arrowMove = window.dash_clientside.stage.arrowMove;
+            const THROTTLE_MS = 80;  // auto-repeat of a held key: at most ~12 moves/s
+            const pending = {};
+            const held = new Set();  // arrows currently down, for diagonal moves
+            const flush = function(){
+                window._jogFrame = null;
+                const ws = window._stageWs;
+                for (const axis in pending) {
+                    if (ws && ws.readyState === WebSocket.OPEN) { ws.send(JSON.stringify({axis: axis, d: pending[axis]})); }
+                    delete pending[axis];
+                }
+            };
+            window._dashKeyListener = function(e){
+                const move = arrowMove(e.key, e.shiftKey);
+                if (!move) { return; }
+                const tag = (e.target && e.target.tagName) || "";
+                if (tag === "INPUT" || tag === "TEXTAREA" || tag === "SELECT") { return; }
+                e.preventDefault();
+                held.add(e.key);
+                const now = Date.now();
+                if (e.key === window._lastKey && now - window._lastKeyTs < THROTTLE_MS) { return; }
+                window._lastKey = e.key; window._lastKeyTs = now;
+                const ws = window._stageWs;
+                if (ws && ws.readyState === WebSocket.OPEN) {
+                    // Coalesce per axis and send at most once per animation frame
+                    const [axis, sign] = move;
+                    const step = window._jogUm || 1000;
+                    pending[axis] = (pending[axis] || 0) + sign * step;
+                    if (!window._jogFrame) { window._jogFrame = requestAnimationFrame(flush); }
+                    return;
+                }
+                window.dashKeyEvent = {key: e.key, keys: Array.from(held), shift: e.shiftKey, ts: now};
+            };
+            document.addEventListener("keydown", window._dashKeyListener);
+            // A released key always forwards its next press
+            document.addEventListener("keyup", function(e){ window._lastKey = null; held.delete(e.key); });
+            window.addEventListener("blur", function(){ held.clear(); });
+        }
+        const ev = window.dashKeyEvent;
+        if (!ev || ev.ts === window._dashKeySentTs) { return window.dash_clientside.no_update; }
+        window._dashKeySentTs = ev.ts;
+        return ev;
+    }
+    """,
     Output("store-key", "data"),
     Input("key-poll", "n_intervals")
 )
 
+# Parse the step size when it changes, not on every press
+app.clientside_callback(
+    ClientsideFunction(namespace="stage", function_name="jogStep"),
+    Output("store-jog-um-int", "data"),
+    Input("jog-um", "value"),
+)
 
-def stage_key_actions(key_data, last_ts, jog_um, ready):
-    global _stage_instance
-    if not ready or not _stage_instance:
-        return no_update, last_ts
-    if not key_data:
-        return no_update, last_ts
-    ts = key_data.get("ts")
-    if last_ts == ts:
-        return no_update, last_ts
-    step = 1000
-    try:
-        if jog_um is not None:
-            step = int(jog_um)
-    except Exception:
-        pass
-    key = key_data.get("key")
-    shift = bool(key_data.get("shift"))
-    # Shift+ArrowUp/Down for Z, plain arrows for XY
-    if shift and key == "ArrowUp":
-        _stage_instance.move_z(step)
-        return f"Moved Z by +{step} µm.", ts
-    if shift and key == "ArrowDown":
-        _stage_instance.move_z(-step)
-        return f"Moved Z by -{step} µm.", ts
-    if key == "ArrowLeft":
-        _stage_instance.move_x(-step)
-        return f"Moved X by -{step} µm.", ts
-    if key == "ArrowRight":
-        _stage_instance.move_x(step)
-        return f"Moved X by +{step} µm.", ts
-    if key == "ArrowUp":
-        _stage_instance.move_y(step)
-        return f"Moved Y by +{step} µm.", ts
-    if key == "ArrowDown":
-        _stage_instance.move_y(-step)
-        return f"Moved Y by -{step} µm.", ts
-    return no_update, last_ts
-
-
-def stage_actions(n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown, jog_um, ready):
-    global _stage_instance
-    if not ready or not _stage_instance:
-        return "Stage not connected."
-    try:
-        # Determine which button fired
-        ctx = dash.callback_context
-        if not ctx.triggered:
-            return no_update
-        which = ctx.triggered[0]['prop_id'].split('.')[0]
-        if which == "btn-stage-home":
-            _stage_instance.move_home((0, 0, 0))
-            return "Homing sent (G28)."
-        if which == "btn-stage-level":
-            _stage_instance.auto_level()
-            return "Auto level sent (G29)."
-        # Jogging
-        try:
-            step = int(jog_um) if jog_um is not None else 1000
-        except Exception:
-            step = 1000
-        if which == "btn-left":
-            _stage_instance.move_x(-step)
-            return f"Moved X by -{step} µm."
-        if which == "btn-right":
-            _stage_instance.move_x(step)
-            return f"Moved X by +{step} µm."
-        if which == "btn-up":
-            _stage_instance.move_y(step)
-            return f"Moved Y by +{step} µm."
-        if which == "btn-down":
-            _stage_instance.move_y(-step)
-            return f"Moved Y by -{step} µm."
-        if which == "btn-z-down":
-            _stage_instance.move_z(-step)
-            return f"Moved Z by -{step} µm."
-        if which == "btn-z-up":
-            _stage_instance.move_z(step)
-            return f"Moved Z by +{step} µm."
-        return no_update
-    except Exception as e:
-        return f"Stage action failed: {e}"
-
-@app.callback(
-    Output("stage-action-status", "children"),
+# Jog dispatch runs in the browser (assets/stage.js): keys and buttons become
+# one motion command in stage-cmd, so only real moves reach the server
+app.clientside_callback(
+    ClientsideFunction(namespace="stage", function_name="dispatch"),
+    Output("stage-cmd", "data"),
     Output("store-key-ts", "data"),
-    Input("store-key", "data"),               # keyboard
-    Input("btn-stage-home", "n_clicks"),      # buttons below
+    Input("store-key", "data"),
+    Input("btn-stage-home", "n_clicks"),
     Input("btn-stage-level", "n_clicks"),
     Input("btn-left", "n_clicks"),
     Input("btn-right", "n_clicks"),
@@ -808,134 +1217,65 @@ def stage_actions(n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown, jog_
     Input("btn-down", "n_clicks"),
     Input("btn-z-up", "n_clicks"),
     Input("btn-z-down", "n_clicks"),
-    State("jog-um", "value"),
-    State("store-stage-ready", "data"),
+    State("store-jog-um-int", "data"),
     State("store-key-ts", "data"),
     prevent_initial_call=True,
 )
-def stage_actions_combined(
-    key_data,
-    n_home, n_level, nleft, nright, nup, ndown, nzup, nzdown,
-    jog_um, ready, last_ts
-):
-    global _stage_instance
 
-    # No stage connection yet
-    if not ready or not _stage_instance:
-        return "Stage not connected.", last_ts
-
-    ctx = dash.callback_context
-    if not ctx.triggered:
+@app.callback(
+    Output("stage-done", "data"),
+    Input("stage-cmd", "data"),
+    State("store-stage-ready", "data"),
+    prevent_initial_call=True,
+)
+def stage_run_cmd(cmd, ready):
+    if not cmd:
         raise PreventUpdate
-
-    which = ctx.triggered[0]["prop_id"].split(".")[0]
-
-    # ---------------- Keyboard arrows ----------------
-    if which == "store-key":
-        if not key_data:
-            raise PreventUpdate
-
-        ts = key_data.get("ts")
-        if ts is None or ts == last_ts:
-            # already handled this keystroke
-            raise PreventUpdate
-
-        # step size from UI
-        step = 1000
-        try:
-            if jog_um is not None:
-                step = int(jog_um)
-        except Exception:
-            pass
-
-        key = key_data.get("key")
-        shift = bool(key_data.get("shift"))
-
-        # Shift+ArrowUp/Down for Z
-        if shift and key == "ArrowUp":
-            _stage_instance.move_z(step)
-            return f"Moved Z by +{step} µm.", ts
-        if shift and key == "ArrowDown":
-            _stage_instance.move_z(-step)
-            return f"Moved Z by -{step} µm.", ts
-
-        # plain arrows for XY
-        if key == "ArrowLeft":
-            _stage_instance.move_x(-step)
-            return f"Moved X by -{step} µm.", ts
-        if key == "ArrowRight":
-            _stage_instance.move_x(step)
-            return f"Moved X by +{step} µm.", ts
-        if key == "ArrowUp":
-            _stage_instance.move_y(step)
-            return f"Moved Y by +{step} µm.", ts
-        if key == "ArrowDown":
-            _stage_instance.move_y(-step)
-            return f"Moved Y by -{step} µm.", ts
-
-        # Unhandled key: no update
+    if not ready or not _stage_instance:
+        return {"ts": cmd.get("ts"), "error": "Stage not connected."}
+    action = cmd.get("action")
+    if action not in _STAGE_ACTIONS:
         raise PreventUpdate
-
-    # ---------------- Button actions ----------------
-    # Determine jog step
+    # Queue it for the stage worker and answer right away
     try:
-        step = int(jog_um) if jog_um is not None else 1000
-    except Exception:
-        step = 1000
-
-    if which == "btn-stage-home":
-        _stage_instance.move_home((0, 0, 0))
-        return "Homing sent (G28).", last_ts
-
-    if which == "btn-stage-level":
-        _stage_instance.auto_level()
-        return "Auto level sent (G29).", last_ts
-
-    if which == "btn-left":
-        _stage_instance.move_x(-step)
-        return f"Moved X by -{step} µm.", last_ts
-
-    if which == "btn-right":
-        _stage_instance.move_x(step)
-        return f"Moved X by +{step} µm.", last_ts
-
-    if which == "btn-up":
-        _stage_instance.move_y(step)
-        return f"Moved Y by +{step} µm.", last_ts
-
-    if which == "btn-down":
-        _stage_instance.move_y(-step)
-        return f"Moved Y by -{step} µm.", last_ts
-
-    if which == "btn-z-up":
-        _stage_instance.move_z(step)
-        return f"Moved Z by +{step} µm.", last_ts
-
-    if which == "btn-z-down":
-        _stage_instance.move_z(-step)
-        return f"Moved Z by -{step} µm.", last_ts
-
-    # Fallback
-    raise PreventUpdate
+        _stage_cmd_q.put_nowait((action, int(cmd.get("dx") or 0), int(cmd.get("dy") or 0), int(cmd.get("dz") or 0)))
+    except queue.Full:
+        return {"ts": cmd.get("ts"), "error": "Stage busy: command dropped."}
+    except (TypeError, ValueError) as e:
+        return {"ts": cmd.get("ts"), "error": f"Stage action failed: {e}"}
+    return {"ts": cmd.get("ts")}
+
+# The status line is formatted in the browser from the command it already holds
+app.clientside_callback(
+    ClientsideFunction(namespace="stage", function_name="status"),
+    Output("stage-action-status", "children"),
+    Input("stage-done", "data"),
+    State("stage-cmd", "data"),
+    prevent_initial_call=True,
+)
 
 
 if __name__ == '__main__':
     import threading, time
 
-    def _open_browser_when_ready(url: str, timeout: float = 20.0):
+    def _open_browser_when_ready(url: str, port: int, timeout: float = 20.0):
+        # Resolve the browser controller while the server is still starting
+        try:
+            browser = webbrowser.get()
+        except webbrowser.Error:
+            browser = webbrowser
+        # A plain TCP connect succeeds as soon as the server is listening
         start = time.time()
         while time.time() - start < timeout:
             try:
-                r = requests.get(url, timeout=0.5)
-                if r.status_code in (200, 302, 404):
-                    webbrowser.open(url)
-                    return
-            except Exception:
-                time.sleep(0.3)
-        webbrowser.open(url)
+                socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        browser.open_new_tab(url)
 
     port = find_open_port()
     url = f"http://127.0.0.1:{port}"
     print(f"Starting server on {url}")
-    threading.Thread(target=_open_browser_when_ready, args=(url,), daemon=True).start()
+    threading.Thread(target=_open_browser_when_ready, args=(url, port), daemon=True).start()
     app.run(debug=False, port=port, host="127.0.0.1", use_reloader=False)
@@ -4,18 +4,41 @@
 
 from __future__ import annotations
 import io, json, zipfile, os, socket, webbrowser
+import copy
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Any, Dict
 import requests, pandas as pd
+import numpy as np
+try:
+    import orjson  # optional; faster parsing/dumping of large analyzer results
+except ImportError:
+    orjson = None
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import plotly.graph_objs as go
 import dash
-from dash import Dash, dcc, html, Input, Output, State, no_update
+from dash import Dash, dcc, html, Input, Output, State, no_update, ClientsideFunction
+from flask import Response
 
 APP_TITLE = "SciAps X-550 Basic"
 DEFAULT_PORT_START = 8070
 
 # ---------------------- Helpers ----------------------
 
+# One pooled session for every analyzer call: status polls, beams, analyze and
+# photos reuse the same keep-alive connection instead of a new one per request
+_SESSION = requests.Session()
+# connect=0: a refused port must fail at once, or the port scan in connect() crawls.
+# read=0: a hung analyzer must not be waited on again; only busy-gateway replies are retried.
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                      max_retries=Retry(total=2, connect=0, read=0,
+                                                        status_forcelist=(502, 503, 504), raise_on_status=False,
+                                                        backoff_factor=0.2)))
+
 def ts_utc():
     return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
@@ -35,39 +58,53 @@ def find_open_port(start_port=DEFAULT_PORT_START):
 def base_url(ip: str, port: int) -> str:
     return f"http://{ip}:{port}/api/v2"
 
+def _json_of(r):
+    return orjson.loads(r.content) if orjson is not None else r.json()
+
+def _json_body(data: Dict[str, Any] | None):
+    # kwargs for a JSON request body, encoded with orjson when available
+    if orjson is None:
+        return {"json": data or {}}
+    return {"data": orjson.dumps(data or {}), "headers": {"Content-Type": "application/json"}}
+
 def api_get(url, **kw):
-    r = requests.get(url, timeout=30, **kw)
+    r = _SESSION.get(url, timeout=kw.pop("timeout", 30), **kw)
     r.raise_for_status()
-    return r.json() if r.headers.get("Content-Type", "").startswith("application/json") else r.content
+    return _json_of(r) if r.headers.get("Content-Type", "").startswith("application/json") else r.content
 
 def api_post(url, data: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None, **kw):
-    r = requests.post(url, params=params or {}, json=data or {}, timeout=kw.get("timeout", 600))
+    r = _SESSION.post(url, params=params or {}, timeout=kw.get("timeout", 600), **_json_body(data))
     try:
         r.raise_for_status()
     except requests.HTTPError as e:
         msg = r.text.strip()
         raise requests.HTTPError(f"{e} | server says: {msg}")
-    return r.json()
+    return _json_of(r)
 
 def api_put(url, data: Dict[str, Any] | None = None, params: Dict[str, Any] | None = None, **kw):
-    r = requests.put(url, params=params or {}, json=data or {}, timeout=kw.get("timeout", 60))
+    r = _SESSION.put(url, params=params or {}, timeout=kw.get("timeout", 60), **_json_body(data))
     try:
         r.raise_for_status()
     except requests.HTTPError as e:
         msg = r.text.strip()
         raise requests.HTTPError(f"{e} | server says: {msg}")
-    return r.json() if r.headers.get("Content-Type", "").startswith("application/json") else r.text
+    return _json_of(r) if r.headers.get("Content-Type", "").startswith("application/json") else r.text
+
+_PERIODIC_SYMBOLS = (None, 'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P','S','Cl','Ar',
+                     'K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr',
+                     'Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh','Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe',
+                     'Cs','Ba','La','Ce','Pr','Nd','Pm','Sm','Eu','Gd','Tb','Dy','Ho','Er','Tm','Yb','Lu',
+                     'Hf','Ta','W','Re','Os','Ir','Pt','Au','Hg','Tl','Pb','Bi','Po','At','Rn',
+                     'Fr','Ra','Ac','Th','Pa','U','Np','Pu','Am','Cm','Bk','Cf','Es','Fm','Md','No','Lr',
+                     'Rf','Db','Sg','Bh','Hs','Mt','Ds','Rg','Cn','Nh','Fl','Mc','Lv','Ts','Og')
 
 def normalize_chemistry(result_json: Dict[str, Any]):
     rows = []
     td = result_json.get("testData")
     if isinstance(td, dict) and isinstance(td.get("chemistry"), list):
-        symbols = [None, 'H','He','Li','Be','B','C','N','O','F','Ne','Na','Mg','Al','Si','P','S','Cl','Ar',
-                   'K','Ca','Sc','Ti','V','Cr','Mn','Fe','Co','Ni','Cu','Zn','Ga','Ge','As','Se','Br','Kr',
-                   'Rb','Sr','Y','Zr','Nb','Mo','Tc','Ru','Rh','Pd','Ag','Cd','In','Sn','Sb','Te','I','Xe']
         for it in td["chemistry"]:
             z = it.get("atomicNumber")
-            elem = symbols[z] if isinstance(z, int) and 0 < z < len(symbols) else f"Z{z}"
+            elem = _PERIODIC_SYMBOLS[z] if isinstance(z, int) and 0 < z < len(_PERIODIC_SYMBOLS) else f"Z{z}"
             val = it.get("percent")
             if elem and val is not None:
                 rows.append({"analyte": elem, "value": val, "units": "wt%"})
@@ -93,16 +130,53 @@ def normalize_spectra(result_json: Dict[str, Any]):
                 continue
             e0 = sp.get("energyOffset", 0.0)
             slope = sp.get("energySlope", 1.0)
-            x = [e0 + slope * j for j in range(len(y))]
+            # Arrays go straight into the figure; Dash's JSON encoder handles them in the store
+            y = np.asarray(y)
+            x = e0 + slope * np.arange(y.size, dtype=np.float64)
             name = sp.get("beamName") or f"beam_{i}"
-            spectra.append({"shot": name, "x": x, "y": y})
+            spectra.append({"shot": name, "x": x, "y": y, "e0": e0, "slope": slope})
     return spectra
 
+# Raw analyzer results stay on the server; store-latest only carries their key
+_RESULTS_MAX = 8
+_results: "OrderedDict[str, Any]" = OrderedDict()
+_results_lock = threading.Lock()
+
+def _keep_result(key: str, res: Any):
+    with _results_lock:
+        _results[key] = res
+        _results.move_to_end(key)
+        while len(_results) > _RESULTS_MAX:
+            _results.popitem(last=False)
+
+def _get_result(key: str | None):
+    with _results_lock:
+        return _results.get(key)
+
+# Captured JPEGs, served from /photo/<key>.jpg so they never cross the callback JSON.
+# Each capture gets its own key, so clients never see each other's shots.
+_PHOTOS_MAX = 8
+_photos: "OrderedDict[str, bytes]" = OrderedDict()
+_photos_lock = threading.Lock()
+
 # ---------------------- App ----------------------
 
+if orjson is not None:
+    # Dash encodes callback responses (figures, store-latest) through plotly's JSON layer
+    import plotly.io as pio
+    pio.json.config.default_engine = "orjson"
+
 app = Dash(__name__)
 app.title = APP_TITLE
 
+@app.server.route("/photo/<key>.jpg")
+def photo_jpeg(key):
+    with _photos_lock:
+        jpeg = _photos.get(key)
+    if jpeg is None:
+        return Response(status=404)
+    return Response(jpeg, mimetype="image/jpeg", headers={"Cache-Control": "no-store"})
+
 app.layout = html.Div([
     html.H2(APP_TITLE),
     html.Details([
@@ -124,7 +198,8 @@ app.layout = html.Div([
     ], style={"display": "flex", "gap": "8px", "alignItems": "center", "flexWrap": "wrap"}),
 
     html.Div(id="live-status", style={"marginTop": "6px", "fontSize": "14px"}),
-    dcc.Interval(id="status-timer", interval=5000, n_intervals=0, disabled=True),
+    dcc.Interval(id="status-timer", interval=10000, n_intervals=0, disabled=True),
+    dcc.Store(id="tab-visible", data=True),  # kept current by assets/visibility.js
 
     html.Hr(),
 
@@ -166,6 +241,7 @@ app.layout = html.Div([
             style={"width": "220px"}
         ),
         html.Button("📸 Take Photo", id="btn-photo", n_clicks=0),
+        html.Span(id="photo-status", style={"marginLeft": "8px", "fontStyle": "italic"}),
     ], style={"display": "flex", "gap": "8px", "alignItems": "center", "flexWrap": "wrap"}),
 
     html.Img(id="photo-display",
@@ -188,51 +264,45 @@ app.layout = html.Div([
 def _count_beams(cfg: Dict[str, Any]) -> int:
     if not isinstance(cfg, dict):
         return 0
-    # Newer/minimal schema: arrays at the top level
-    if isinstance(cfg.get("beamTimes"), list):
-        return len(cfg["beamTimes"])
-    # Classic nested schema
-    if isinstance(cfg.get("beams"), list):
-        return len(cfg["beams"])
-    for v in cfg.values():
-        if isinstance(v, dict):
-            n = _count_beams(v)
-            if n:
-                return n
-    return 0
-    if isinstance(cfg.get("beams"), list):
-        return len(cfg["beams"])
-    for v in cfg.values():
-        if isinstance(v, dict):
-            n = _count_beams(v)
-            if n:
-                return n
+    # Depth-first over nested dicts, same order as a recursive walk, without a frame per node
+    stack = deque([cfg])
+    while stack:
+        x = stack.pop()
+        # Newer/minimal schema: arrays at the top level
+        if isinstance(x.get("beamTimes"), list):
+            if x["beamTimes"]:
+                return len(x["beamTimes"])
+            continue
+        # Classic nested schema
+        if isinstance(x.get("beams"), list):
+            if x["beams"]:
+                return len(x["beams"])
+            continue
+        stack.extend(v for v in reversed(x.values()) if isinstance(v, dict))
     return 0
 
 _DURATION_KEYS = {"duration", "durationSec", "durationSecs", "durationSeconds", "testTimeSeconds"}
+_DURATION_KEYS_LOWER = {s.lower() for s in _DURATION_KEYS}
 
 def _set_beam_durations(cfg: Any, dur: int):
     # dur is in SECONDS from the UI
-    if isinstance(cfg, dict):
-        # Minimal schema: list of beamTimes in milliseconds
-        if isinstance(cfg.get("beamTimes"), list):
-            ms = max(1, int(round(dur * 1000)))
-            cfg["beamTimes"] = [ms for _ in cfg["beamTimes"]]
-        # Classic schema
-        if isinstance(cfg.get("beams"), list):
-            for b in cfg["beams"]:
-                if isinstance(b, dict):
-                    for k in list(b.keys()):
-                        if k in _DURATION_KEYS or k.lower() in {s.lower() for s in _DURATION_KEYS}:
-                            b[k] = dur
-                        elif isinstance(b[k], (dict, list)):
-                            _set_beam_durations(b[k], dur)
-        for k, v in cfg.items():
-            if isinstance(v, (dict, list)):
-                _set_beam_durations(v, dur)
-    elif isinstance(cfg, list):
-        for it in cfg:
-            _set_beam_durations(it, dur)
+    stack = deque([cfg])
+    while stack:
+        x = stack.pop()
+        if isinstance(x, dict):
+            # Minimal schema: list of beamTimes in milliseconds
+            if isinstance(x.get("beamTimes"), list):
+                x["beamTimes"] = [max(1, int(round(dur * 1000)))] * len(x["beamTimes"])
+            # Classic schema
+            if isinstance(x.get("beams"), list):
+                for b in x["beams"]:
+                    if isinstance(b, dict):
+                        for k in b:
+                            if k.lower() in _DURATION_KEYS_LOWER:
+                                b[k] = dur
+            stack.extend(v for v in x.values() if isinstance(v, (dict, list)))
+        elif isinstance(x, list):
+            stack.extend(v for v in x if isinstance(v, (dict, list)))
 
 # Load current acquisition parameters for selected mode
 @app.callback(
@@ -273,14 +343,15 @@ def apply_beams(_n, sec, cfg, base, mode):
         return "Load beams first."
     try:
         sec = float(sec)
-        new_cfg = json.loads(json.dumps(cfg))  # deep copy
-        if isinstance(new_cfg.get("beamTimes"), list):
-            # Minimal schema: update ms directly and keep existing flags/testType
+        if isinstance(cfg.get("beamTimes"), list):
+            # Minimal schema: only beamTimes changes, so a shallow rebuild is enough;
+            # existing flags/testType are kept as-is
             ms = max(1, int(round(sec * 1000)))
-            new_cfg["beamTimes"] = [ms for _ in new_cfg["beamTimes"]]
+            new_cfg = {**cfg, "beamTimes": [ms] * len(cfg["beamTimes"])}
             api_put(base + "/acquisitionParams/user", params={"mode": mode}, data=new_cfg)
             return f"Applied {sec:g}s per beam to mode '{mode}'. (beamTimes in ms)"
-        # Classic schema path
+        # Classic schema path: durations are nested, so copy the whole tree first
+        new_cfg = copy.deepcopy(cfg)
         _set_beam_durations(new_cfg, sec)
         api_put(base + "/acquisitionParams/user", params={"mode": mode}, data=new_cfg)
         return f"Applied {int(sec)}s per beam to mode '{mode}'."
@@ -306,55 +377,138 @@ def fill_ip(n_usb, n_hot, current):
     Output("store-modes", "data"),
     Output("mode", "options"),
     Output("mode", "value"),
-    Output("status-timer", "disabled"),
     Input("btn-connect", "n_clicks"), State("ip", "value"), State("port", "value"),
     prevent_initial_call=True)
 def connect(n, ip, port):
     try:
         start = int(port) if str(port).isdigit() else 8080
         info = None; chosen = None
-        for try_p in range(start, start + 10):
-            for path in ("/api/v2/id", "/api/v1/id", "/api/id"):
-                url = f"http://{ip}:{try_p}{path}"
+        # Probe every port/path at once, but take the answers in scan order (lowest port, then
+        # v2, v1, bare), so the same analyzer is picked as by the old one-by-one loop
+        urls = [f"http://{ip}:{p}{path}" for p in range(start, start + 10)
+                for path in ("/api/v2/id", "/api/v1/id", "/api/id")]
+
+        def probe(url):
+            r = _SESSION.get(url, timeout=2)
+            r.raise_for_status()
+            if not (r.headers.get("Content-Type", "").startswith("application/json") or r.text.startswith("{")):
+                raise ValueError("not a JSON API")
+            return _json_of(r)
+
+        ex = ThreadPoolExecutor(max_workers=8)
+        try:
+            futs = [ex.submit(probe, u) for u in urls]
+            for url, fut in zip(urls, futs):
                 try:
-                    r = requests.get(url, timeout=5)
-                    r.raise_for_status()
-                    if r.headers.get("Content-Type", "").startswith("application/json") or r.text.startswith("{"):
-                        info = r.json(); chosen = f"http://{ip}:{try_p}" + path.rsplit("/", 1)[0]
-                        break
+                    info = fut.result()
                 except Exception:
                     continue
-            if chosen:
+                chosen = url.rsplit("/", 1)[0]
                 break
+        finally:
+            ex.shutdown(wait=False, cancel_futures=True)
         if not chosen:
-            return (f"Connect failed: no API found. Make sure the analyzer shows the RemoteService screen with an IP (enable 'Show IP'), then use that IP. Searched {ip}:{start}-{start+9}", None, None, [], None, True)
+            return (f"Connect failed: no API found. Make sure the analyzer shows the RemoteService screen with an IP (enable 'Show IP'), then use that IP. Searched {ip}:{start}-{start+9}", None, None, [], None)
         apps = info.get("apps", []) if isinstance(info, dict) else []
         options = [{"label": a, "value": a} for a in apps] if apps else []
         default_mode = options[0]["value"] if options else None
-        return f"Connected: {info.get('family', 'X-550')} | Base: {chosen}", chosen, apps, options, default_mode, False
+        return f"Connected: {info.get('family', 'X-550')} | Base: {chosen}", chosen, apps, options, default_mode
     except Exception as e:
-        return f"Connect failed: {e}", None, None, [], None, True
+        return f"Connect failed: {e}", None, None, [], None
+
+# Poll only while connected and while the tab is visible
+app.clientside_callback(
+    ClientsideFunction(namespace="visibility", function_name="pollDisabled"),
+    Output("status-timer", "disabled"),
+    Input("tab-visible", "data"),
+    Input("store-base", "data"),
+)
+
+def _is_number(v) -> bool:
+    return isinstance(v, (int, float))
+
+def _not_none(v) -> bool:
+    return v is not None
+
+# Status fields move between keys across firmwares. Each tuple lists (path, check) in the
+# priority order of the original or/if chains, with the same truthiness test per step.
+_BATT_FIELDS = (
+    (("battery", "percent"), bool),
+    (("battery", "level"), _not_none),
+    (("batteryPercent",), _not_none),
+    (("batteryLevel",), _not_none),
+    (("battery",), _is_number),
+)
+_UPTIME_FIELDS = (
+    (("uptimeSec",), bool), (("uptimeSeconds",), bool), (("upTimeSec",), bool), (("upTimeSeconds",), bool),
+    (("uptime",), _not_none),  # end of the or-chain: taken as-is, even if falsy
+)
+_BEAM_FIELDS = (
+    (("beamState",), bool), (("beamStatus",), bool), (("acquisitionState",), bool), (("xrayState",), bool),
+    (("state",), _not_none),
+)
+
+# Per analyzer base: for each field, the candidates whose keys that analyzer actually sends
+_status_paths: Dict[str, Dict[str, tuple]] = {}
+
+def _dig(s: Any, path: tuple):
+    for k in path:
+        if not isinstance(s, dict):
+            return None
+        s = s.get(k)
+    return s
+
+def _has(s: Any, path: tuple) -> bool:
+    for k in path:
+        if not isinstance(s, dict) or k not in s:
+            return False
+        s = s[k]
+    return True
+
+def _first_ok(s: Dict[str, Any], candidates: tuple):
+    for path, ok in candidates:
+        v = _dig(s, path)
+        if ok(v):
+            return v
+    return None
+
+def _status_field(s: Dict[str, Any], known: Dict[str, tuple], field: str, candidates: tuple):
+    # Absent keys always fail their check, so trying only the keys this analyzer sent gives the
+    # same answer as the full chain while its key set is unchanged; a miss rescans in case it changed
+    present = known.get(field)
+    if present is not None:
+        v = _first_ok(s, present)
+        if v is not None:
+            return v
+    present = known[field] = tuple(c for c in candidates if _has(s, c[0]))
+    return _first_ok(s, present)
+
+# (connect, read) for the status poll; a stuck analyzer gives up well inside one tick
+STATUS_TIMEOUT = (1.5, 2.5)
+
+def _fmt_uptime(val):
+    try:
+        secs = int(val)
+        h = secs // 3600
+        m = (secs % 3600) // 60
+        sec = secs % 60
+        return f"{h:02d}:{m:02d}:{sec:02d}"
+    except Exception:
+        return None
 
 @app.callback(
     Output("live-status", "children"),
-    Input("status-timer", "n_intervals"), State("store-base", "data"),
+    Input("status-timer", "n_intervals"), State("store-base", "data"), State("live-status", "children"),
     prevent_initial_call=True)
-def poll_status(_n, base):
+def poll_status(_n, base, shown):
     if not base:
         return no_update
     try:
-        s = api_get(base + "/status")
+        s = api_get(base + "/status", timeout=STATUS_TIMEOUT)
+        known = _status_paths.setdefault(base, {})
 
         # --- Battery (support multiple schemas) ---
-        batt = None
-        if isinstance(s.get("battery"), dict):
-            batt = s["battery"].get("percent") or s["battery"].get("level")
-        if batt is None and s.get("batteryPercent") is not None:
-            batt = s.get("batteryPercent")
-        if batt is None and s.get("batteryLevel") is not None:
-            batt = s.get("batteryLevel")
-        if batt is None and isinstance(s.get("battery"), (int, float)):
-            batt = s.get("battery")
+        batt = _status_field(s, known, "batt", _BATT_FIELDS)
         charging = s.get("isCharging")
         batt_str = f"{batt:.0f}%" if isinstance(batt, (int, float)) else "(no batt data)"
         if charging is True:
@@ -363,7 +517,7 @@ def poll_status(_n, base):
         # --- Temperatures ---
         temp_parts = []
         if isinstance(s.get("temperatures"), dict):
-            temp_parts.extend([f"{k}:{v:.1f}°C" for k, v in s["temperatures"].items() if isinstance(v, (int, float))])
+            temp_parts.extend(f"{k}:{v:.1f}°C" for k, v in s["temperatures"].items() if isinstance(v, (int, float)))
         # explicit tube/detector fields seen on some firmwares
         if isinstance(s.get("tubeTemp"), (int, float)):
             temp_parts.append(f"tube:{s['tubeTemp']:.1f}°C")
@@ -374,29 +528,17 @@ def poll_status(_n, base):
         t_text = ", ".join(temp_parts) if temp_parts else "(no temp data)"
 
         # --- Uptime ---
-        up = (
-            s.get("uptimeSec") or s.get("uptimeSeconds") or s.get("upTimeSec") or s.get("upTimeSeconds") or s.get("uptime")
-        )
-        def _fmt_uptime(val):
-            try:
-                secs = int(val)
-                h = secs // 3600
-                m = (secs % 3600) // 60
-                sec = secs % 60
-                return f"{h:02d}:{m:02d}:{sec:02d}"
-            except Exception:
-                return None
-        up_str = _fmt_uptime(up) if up is not None else None
-        up_text = up_str or "(n/a)"
+        up = _status_field(s, known, "up", _UPTIME_FIELDS)
+        up_text = (_fmt_uptime(up) if up is not None else None) or "(n/a)"
 
         # --- Beam / acquisition state ---
-        beam = s.get("beamState") or s.get("beamStatus") or s.get("acquisitionState") or s.get("xrayState") or s.get("state")
+        beam = _status_field(s, known, "beam", _BEAM_FIELDS)
         beam_text = str(beam) if beam is not None else "(unknown)"
 
         msg = f"Battery: {batt_str} | Temps: {t_text} | Uptime: {up_text} | Beam: {beam_text}"
         if s.get("isECalNeeded"):
             msg += " | E-Cal needed"
-        return msg
+        return no_update if msg == shown else msg
 
     except Exception as e:
         return f"(status unavailable: {e})"
@@ -417,7 +559,12 @@ def analyze(n, base, mode, kind):
         fig = go.Figure()
         for s in spectra:
             fig.add_trace(go.Scatter(x=s['x'], y=s['y'], mode='lines', name=s['shot']))
-        payload = {"ts": ts_utc(), "mode": mode or "", "result_raw": res, "chem_rows": chem, "spectra": spectra}
+        ts = ts_utc()
+        key = f"{ts}_{mode or ''}"
+        _keep_result(key, res)
+        # Compact store: the energy axis travels as (e0, slope), not as a list per spectrum
+        compact = [{"shot": s["shot"], "e0": s["e0"], "slope": s["slope"], "y": s["y"]} for s in spectra]
+        payload = {"ts": ts, "mode": mode or "", "key": key, "chem_rows": chem, "spectra": compact}
         return summary, fig, payload
     except Exception as e:
         return f"Run failed: {e}", go.Figure(), None
@@ -429,34 +576,41 @@ def analyze(n, base, mode, kind):
 def save_latest(_n, payload, save_dir):
     if not payload:
         return no_update, "No result in memory. Run Analyze first."
-    result_raw = payload.get("result_raw", {})
-    chem_rows = payload.get("chem_rows") or normalize_chemistry(result_raw) or []
-    spectra = payload.get("spectra") or normalize_spectra(result_raw) or []
+    result_raw = _get_result(payload.get("key"))
+    chem_rows = payload.get("chem_rows") or []
+    spectra = payload.get("spectra") or []
 
-    mem = io.BytesIO()
-    with zipfile.ZipFile(mem, 'w', zipfile.ZIP_DEFLATED) as zf:
+    out_dir = save_dir or os.path.join(os.getcwd(), "x550_runs")
+    os.makedirs(out_dir, exist_ok=True)
+    fname = f"sciaps_{(payload.get('mode', 'mode') or 'mode').lower()}_{payload.get('ts', ts_utc())}.zip"
+    out_path = os.path.join(out_dir, fname)
+
+    # Write the archive once, straight to disk, and stream that file as the download.
+    # Level 3: JSON/CSV compress nearly as well as the default 6 at a fraction of the CPU
+    with zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=3) as zf:
         ts = payload.get("ts", ts_utc()); mode = payload.get("mode", "mode")
-        zf.writestr(f"result_{mode}_{ts}.json", json.dumps(result_raw, indent=2))
+        if result_raw is not None:  # gone only if the server restarted since Analyze
+            raw = (orjson.dumps(result_raw, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+                   if orjson is not None else json.dumps(result_raw, indent=2))
+            zf.writestr(f"result_{mode}_{ts}.json", raw)
         if chem_rows:
             dfc = pd.DataFrame(chem_rows)
             zf.writestr(f"chemistry_{mode}_{ts}.csv", dfc.to_csv(index=False))
         for s in spectra:
             name = (s.get("shot") or "final").replace(" ", "_")
-            dfs = pd.DataFrame({"channel": s.get("x", []), "counts": s.get("y", [])})
-            zf.writestr(f"spectrum_{name}_{ts}.csv", dfs.to_csv(index=False))
-    mem.seek(0)
-
-    out_dir = save_dir or os.path.join(os.getcwd(), "x550_runs")
-    os.makedirs(out_dir, exist_ok=True)
-    fname = f"sciaps_{(payload.get('mode', 'mode') or 'mode').lower()}_{payload.get('ts', ts_utc())}.zip"
-    out_path = os.path.join(out_dir, fname)
-    with open(out_path, 'wb') as f:
-        f.write(mem.getvalue())
+            buf = io.StringIO()
+            y = np.asarray(s.get("y", []), dtype=np.float64)
+            x = s.get("e0", 0.0) + s.get("slope", 1.0) * np.arange(y.size, dtype=np.float64)
+            np.savetxt(buf, np.column_stack([x, y]),
+                       fmt="%.10g", delimiter=",", header="channel,counts", comments="")
+            zf.writestr(f"spectrum_{name}_{ts}.csv", buf.getvalue())
 
-    return dcc.send_bytes(mem.getvalue(), filename=fname), f"Saved to: {out_path} — and download sent."
+    note = "" if result_raw is not None else " (raw result JSON no longer in memory)"
+    return dcc.send_file(out_path, filename=fname), f"Saved to: {out_path} — and download sent.{note}"
 
 @app.callback(
     Output("photo-display", "src"),
+    Output("photo-status", "children"),
     Input("btn-photo", "n_clicks"),
     State("store-base", "data"),
     State("camera-id", "value"),
@@ -464,27 +618,32 @@ def save_latest(_n, payload, save_dir):
 )
 def take_photo(n, base, camera_id):
     if not base:
-        return no_update
+        return no_update, "Not connected."
     try:
-        r = requests.get(f"{base}/photo", params={"cameraId": camera_id}, timeout=15)
-        r.raise_for_status()
-        import base64
-        b64 = base64.b64encode(r.content).decode("utf-8")
-        return f"data:image/jpeg;base64,{b64}"
+        # Stream the JPEG into one buffer; the previous photo stays up if this fails
+        buf = bytearray()
+        with _SESSION.get(f"{base}/photo", params={"cameraId": camera_id}, timeout=15, stream=True) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=65536):
+                buf += chunk
     except Exception as e:
         print("Photo capture failed:", e)
-        return no_update
+        return no_update, f"Photo failed: {e}"
+    key = str(time.time_ns())
+    with _photos_lock:
+        _photos[key] = bytes(buf)
+        while len(_photos) > _PHOTOS_MAX:
+            _photos.popitem(last=False)
+    return f"/photo/{key}.jpg", ""
 
 
 
 if __name__ == '__main__':
-    import threading, time
-
     def _open_browser_when_ready(url: str, timeout: float = 20.0):
         start = time.time()
         while time.time() - start < timeout:
             try:
-                r = requests.get(url, timeout=0.5)
+                r = _SESSION.get(url, timeout=0.5)
                 if r.status_code in (200, 302, 404):
                     webbrowser.open(url)
                     return
@@ -0,0 +1,86 @@
+// Stage jog dispatch for 550_app_v4.py (clientside callback, namespace "stage").
+// Turns an arrow key or stage button into one motion command for stage-cmd;
+// the server callback only executes it, and status() renders the result.
+(function() {
+// Lookup tables built once: [action, axis, sign] per button, [axis, sign] per arrow
+const STAGE_BUTTONS = {
+    "btn-stage-home": ["home"],
+    "btn-stage-level": ["level"],
+    "btn-left": ["jog", "x", -1],
+    "btn-right": ["jog", "x", 1],
+    "btn-up": ["jog", "y", 1],
+    "btn-down": ["jog", "y", -1],
+    "btn-z-up": ["jog", "z", 1],
+    "btn-z-down": ["jog", "z", -1],
+};
+const ARROWS = {ArrowLeft: ["x", -1], ArrowRight: ["x", 1], ArrowUp: ["y", 1], ArrowDown: ["y", -1]};
+
+// [axis, sign] for an arrow key (Shift turns Up/Down into Z), or null
+const arrowMove = function(key, shift) {
+    const move = ARROWS[key];
+    if (!move) { return null; }
+    return (shift && move[0] === "y") ? ["z", move[1]] : move;
+};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    stage: {
+        arrowMove: arrowMove,  // shared with the key listener in the app
+
+        dispatch: function(keyData, nHome, nLevel, nLeft, nRight, nUp, nDown, nZUp, nZDown, jogUm, lastTs) {
+            const noUpdate = window.dash_clientside.no_update;
+            const triggered = window.dash_clientside.callback_context.triggered;
+            if (!triggered || !triggered.length) { return [noUpdate, noUpdate]; }
+            const which = triggered[0].prop_id.split(".")[0];
+            const step = jogUm || 1000;
+            const ts = Date.now();
+
+            const jog = function(axis, sign) {
+                const cmd = {action: "jog", dx: 0, dy: 0, dz: 0, ts: ts};
+                cmd["d" + axis] = sign * step;
+                return cmd;
+            };
+
+            if (which === "store-key") {
+                if (!keyData || keyData.ts == null || keyData.ts === lastTs) { return [noUpdate, noUpdate]; }
+                // Every arrow held right now goes into the same command, so
+                // Up+Right becomes one diagonal move instead of two
+                const keys = (keyData.keys && keyData.keys.length) ? keyData.keys : [keyData.key];
+                let cmd = null;
+                for (const key of keys) {
+                    const move = arrowMove(key, keyData.shift);
+                    if (!move) { continue; }
+                    const [axis, sign] = move;
+                    cmd = cmd || jog(axis, 0);
+                    cmd["d" + axis] += sign * step;
+                }
+                return [cmd || noUpdate, keyData.ts];
+            }
+
+            const btn = STAGE_BUTTONS[which];
+            if (!btn) { return [noUpdate, noUpdate]; }
+            return [btn[0] === "jog" ? jog(btn[1], btn[2]) : {action: btn[0], ts: ts}, noUpdate];
+        },
+
+        jogStep: function(value) {
+            const n = parseInt(value, 10);
+            window._jogUm = (isFinite(n) && n > 0) ? n : 1000;  // also read by the websocket key path
+            return window._jogUm;
+        },
+
+        status: function(done, cmd) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!done) { return noUpdate; }
+            if (done.error) { return done.error; }
+            if (!cmd || cmd.ts !== done.ts) { return noUpdate; }
+            if (cmd.action === "home") { return "Homing sent (G28)."; }
+            if (cmd.action === "level") { return "Auto level sent (G29)."; }
+            const moved = [];
+            for (const axis of ["x", "y", "z"]) {
+                const d = cmd["d" + axis];
+                if (d) { moved.push(axis.toUpperCase() + " by " + (d > 0 ? "+" : "") + d); }
+            }
+            return moved.length ? "Moved " + moved.join(", ") + " µm." : noUpdate;
+        }
+    }
+});
+})();
@@ -0,0 +1,20 @@
+// Pause periodic polling while the tab is hidden (clientside callback, namespace "visibility").
+// Nothing runs at load: the listener is installed by the first callback call, so
+// apps without a tab-visible store are unaffected. Any further inputs (e.g. a
+// connection store) must all be truthy for polling to run.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    visibility: {
+        pollDisabled: function(visible) {
+            if (!window._tabVisibleHooked) {
+                window._tabVisibleHooked = true;
+                document.addEventListener("visibilitychange", function() {
+                    window.dash_clientside.set_props("tab-visible", {data: !document.hidden});
+                });
+            }
+            for (let i = 1; i < arguments.length; i++) {
+                if (!arguments[i]) { return true; }
+            }
+            return visible === false;
+        }
+    }
+});
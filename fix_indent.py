@@ -1,15 +1,18 @@
 # Fix indentation in robotray_dash.py
-with open('robotray_dash.py', 'r') as f:
-    lines = f.readlines()
+import os
 
-# Fix lines 1351-1357 (0-indexed: 1350-1356)
-# Remove 4 spaces from each of these lines
-for i in range(1351, 1358):
-    if i < len(lines) and lines[i].startswith('                        '):
-        lines[i] = lines[i][4:]  # Remove 4 spaces
+SRC = 'robotray_dash.py'
+
+with open(SRC, 'r', encoding='utf-8', newline='') as fin, \
+        open(SRC + '.tmp', 'w', encoding='utf-8', newline='') as fout:
+    for i, line in enumerate(fin):
+        # Fix lines 1351-1357 (0-indexed: 1350-1356)
+        # Remove 4 spaces from each of these lines
+        if 1351 <= i < 1358 and line.startswith('                        '):
+            line = line[4:]
+        fout.write(line)
 
 # Write back
-with open('robotray_dash.py', 'w') as f:
-    f.writelines(lines)
+os.replace(SRC + '.tmp', SRC)
 
 print("Fixed indentation")
@@ -1,15 +1,13 @@
 # Quick fix to remove the + prefix from lines
-with open('robotray_dash.py', 'r', encoding='utf-8') as f:
-    lines = f.readlines()
-
-fixed_lines = []
-for line in lines:
-    if line.startswith('+'):
-        fixed_lines.append(line[1:])
-    else:
-        fixed_lines.append(line)
-
-with open('robotray_dash.py', 'w', encoding='utf-8') as f:
-    f.writelines(fixed_lines)
+import os
+
+SRC = 'robotray_dash.py'
+
+with open(SRC, 'r', encoding='utf-8', newline='') as fin, \
+        open(SRC + '.tmp', 'w', encoding='utf-8', newline='') as fout:
+    for line in fin:
+        fout.write(line[1:] if line.startswith('+') else line)
+
+os.replace(SRC + '.tmp', SRC)
 
 print("Fixed!")
@@ -1,7 +1,35 @@
 import plotly.graph_objects as go
-from collections import defaultdict
 import glob
-import csv
+import hashlib
+import importlib.util
+import os
+import numpy as np
+try:
+    import pandas as pd  # optional; faster CSV parsing than np.loadtxt
+except ImportError:
+    pd = None
+# pyarrow is optional; when installed, read_csv uses its multithreaded Arrow parser
+CSV_ENGINE = "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+
+CACHE_DIR = ".spectra_cache"  # per-sample-type averages, keyed by the input files' mtimes
+COLUMNS = ["Energy (keV)", "Intensity (CPS)"]
+
+
+def cache_path(sample_type, files):
+    h = hashlib.sha1()
+    for f in files:
+        st = os.stat(f)
+        h.update(f"{f}|{st.st_mtime_ns}|{st.st_size}\n".encode())
+    return os.path.join(CACHE_DIR, f"{sample_type}_{h.hexdigest()[:16]}.npz")
+
+
+def read_columns(filepath):
+    """Return the energy and intensity columns of one spectrum CSV as a float64 (n, 2) array."""
+    if pd is not None:
+        return pd.read_csv(filepath, usecols=COLUMNS, dtype="float64", engine=CSV_ENGINE)[COLUMNS].to_numpy()
+    with open(filepath, newline="", encoding="utf-8") as f:
+        header = f.readline().rstrip("\r\n").split(",")
+        return np.loadtxt(f, delimiter=",", usecols=[header.index(c) for c in COLUMNS], ndmin=2)
 
 print("Loading data for all sample types...", flush=True)
 
@@ -28,32 +56,38 @@ for sample_type, color in sample_configs.items():
     if not files:
         continue
     
-    # Aggregate data
-    energy_intensity = defaultdict(list)
-    
-    for filepath in files:
-        try:
-            with open(filepath, newline='', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                for row in reader:
-                    energy = float(row['Energy (keV)'])
-                    intensity = float(row['Intensity (CPS)'])
-                    energy_intensity[energy].append(intensity)
-        except Exception as e:
-            print(f"  Error reading {filepath}: {e}", flush=True)
+    # Aggregate data: mean intensity per energy over all files (reused from disk if unchanged)
+    cached = cache_path(sample_type, files)
+    if os.path.exists(cached):
+        print("  Using cached averages", flush=True)
+        with np.load(cached) as npz:
+            energies, averages = npz["energies"], npz["averages"]
+    else:
+        arrays = []
+        for filepath in files:
+            try:
+                arrays.append(read_columns(filepath))
+            except Exception as e:
+                print(f"  Error reading {filepath}: {e}", flush=True)
+                continue
+        if not arrays:
             continue
+        data = np.concatenate(arrays)
+        # Group by energy: unique sorted keys, then per-key sums and counts in one pass each
+        energies, inv = np.unique(data[:, 0], return_inverse=True)
+        averages = np.bincount(inv, weights=data[:, 1]) / np.bincount(inv)
+        # Cache only complete sets, so a bad file is reported again on the next run
+        if len(arrays) == len(files):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            np.savez(cached, energies=energies, averages=averages)
     
-    # Calculate averages
-    energies = sorted(energy_intensity.keys())
-    averages = [sum(energy_intensity[e]) / len(energy_intensity[e]) for e in energies]
-    
-    # Apply 21-point moving average smoothing
+    # Apply 21-point moving average smoothing (windows shrink at the edges)
     window_size = 21
-    smoothed = []
-    for i in range(len(averages)):
-        start = max(0, i - window_size // 2)
-        end = min(len(averages), i + window_size // 2 + 1)
-        smoothed.append(sum(averages[start:end]) / (end - start))
+    csum = np.concatenate(([0.0], np.cumsum(averages)))
+    idx = np.arange(len(averages))
+    start = np.maximum(idx - window_size // 2, 0)
+    end = np.minimum(idx + window_size // 2 + 1, len(averages))
+    smoothed = (csum[end] - csum[start]) / (end - start)
     
     print(f"  Average intensity range: {min(smoothed):.6f} to {max(smoothed):.6f} CPS", flush=True)
     
@@ -2,6 +2,7 @@ import csv
 import glob
 from collections import defaultdict
 
+import numpy as np
 import plotly.graph_objects as go
 import plotly.io as pio
 
@@ -35,11 +36,11 @@ def load_smoothed_average(sample_type, window_size=21):
     energies = sorted(energy_intensity.keys())
     averages = [sum(energy_intensity[e]) / len(energy_intensity[e]) for e in energies]
 
-    smoothed = []
-    for i in range(len(averages)):
-        start = max(0, i - window_size // 2)
-        end = min(len(averages), i + window_size // 2 + 1)
-        smoothed.append(sum(averages[start:end]) / (end - start))
+    csum = np.concatenate(([0.0], np.cumsum(averages, dtype=np.float64)))
+    idx = np.arange(len(averages))
+    start = np.maximum(idx - window_size // 2, 0)
+    end = np.minimum(idx + window_size // 2 + 1, len(averages))
+    smoothed = (csum[end] - csum[start]) / (end - start)
 
     return energies, smoothed
 
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -57,11 +58,11 @@ for col_idx, (sample_type, color) in enumerate(sample_configs.items(), 1):
     
     # Apply 21-point moving average smoothing
     window_size = 21
-    smoothed = []
-    for i in range(len(averages)):
-        start = max(0, i - window_size // 2)
-        end = min(len(averages), i + window_size // 2 + 1)
-        smoothed.append(sum(averages[start:end]) / (end - start))
+    csum = np.concatenate(([0.0], np.cumsum(averages, dtype=np.float64)))
+    idx = np.arange(len(averages))
+    start = np.maximum(idx - window_size // 2, 0)
+    end = np.minimum(idx + window_size // 2 + 1, len(averages))
+    smoothed = (csum[end] - csum[start]) / (end - start)
     
     print(f"  Average intensity range: {min(smoothed):.6f} to {max(smoothed):.6f} CPS", flush=True)
     
@@ -7,6 +7,8 @@ import glob
 import csv
 from collections import defaultdict
 
+import numpy as np
+
 print("Loading MiningHighVoltage data from sample_outputs...")
 
 # Find only MiningHighVoltage CSV files
@@ -58,11 +60,11 @@ except Exception as e:
     print(f"Could not use scipy smoothing ({e}), using simple moving average instead...")
     # Fallback: simple moving average
     window_size = 21
-    smoothed_intensity = []
-    for i in range(len(avg_intensity)):
-        start = max(0, i - window_size // 2)
-        end = min(len(avg_intensity), i + window_size // 2 + 1)
-        smoothed_intensity.append(sum(avg_intensity[start:end]) / (end - start))
+    csum = np.concatenate(([0.0], np.cumsum(avg_intensity, dtype=np.float64)))
+    idx = np.arange(len(avg_intensity))
+    start = np.maximum(idx - window_size // 2, 0)
+    end = np.minimum(idx + window_size // 2 + 1, len(avg_intensity))
+    smoothed_intensity = (csum[end] - csum[start]) / (end - start)
     print("Applied moving average smoothing")
 
 # Create plot with Plotly
@@ -7,6 +7,8 @@ import glob
 import csv
 from collections import defaultdict
 
+import numpy as np
+
 print("Loading SoilMidVoltage data from sample_outputs...", flush=True)
 
 # Find only SoilMidVoltage CSV files
@@ -49,11 +51,11 @@ print(f"Average intensity range: {min(avg_intensity):.6f} to {max(avg_intensity)
 # Apply simple moving average smoothing
 print("Applying smoothing...", flush=True)
 window_size = 21
-smoothed_intensity = []
-for i in range(len(avg_intensity)):
-    start = max(0, i - window_size // 2)
-    end = min(len(avg_intensity), i + window_size // 2 + 1)
-    smoothed_intensity.append(sum(avg_intensity[start:end]) / (end - start))
+csum = np.concatenate(([0.0], np.cumsum(avg_intensity, dtype=np.float64)))
+idx = np.arange(len(avg_intensity))
+start = np.maximum(idx - window_size // 2, 0)
+end = np.minimum(idx + window_size // 2 + 1, len(avg_intensity))
+smoothed_intensity = (csum[end] - csum[start]) / (end - start)
 print("Applied moving average smoothing", flush=True)
 
 # Create plot with Plotly